@@ -0,0 +1,227 @@
+# app/backup.py
+"""
+在线备份（bot 不停机）：
+
+- SQLite 在线备份 API，每步复制 BACKUP_PAGES 页，步间让出 BACKUP_STEP_PAUSE_MS 毫秒；整个过程跑在线程里，不占事件循环
+- 源连接全程持有一个只读事务：WAL 下它只固定快照、不挡写入，备份也不会因为有新写入而从头重来
+- 产物：<库名>-YYYYmmdd-HHMMSS-微秒.db.gz + 同名 .sha256（sha256sum 格式），保留最近 BACKUP_KEEP 份；
+  .sha256 先于正式文件名写好，看得到 .db.gz 就一定能校验
+- 定时：每天 BACKUP_AT（美东，默认 03:30；设为空关闭）
+
+python -m app.backup now                      # 立即备份一次
+python -m app.backup verify backups/x.db.gz   # 校验哈希 + integrity_check + 各表行数
+python -m app.backup restore backups/x.db.gz --to data.db [--force]   # 先停 bot
+"""
+import argparse, asyncio, glob, gzip, hashlib, logging, os, shutil, sqlite3, tempfile, time
+from datetime import datetime, time as dtime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from . import metrics, storage
+
+log = logging.getLogger("pro-bot.backup")
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_AT: Optional[dtime] = None  # 见下方 _parse_at
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))  # 每步页数（默认页 4KB → 1MB）
+BACKUP_STEP_PAUSE_MS = float(os.getenv("BACKUP_STEP_PAUSE_MS", "2"))
+
+def _parse_at(value: str) -> Optional[dtime]:
+    """BACKUP_AT：HH:MM；空串表示关闭定时备份。格式不对在启动时就报错，而不是等到排定时任务"""
+    if not value.strip():
+        return None
+    try:
+        hh, mm = (int(x) for x in value.split(":"))
+        return dtime(hh, mm)
+    except ValueError:
+        raise ValueError(f"BACKUP_AT 应为 HH:MM（如 03:30），留空关闭定时备份；当前为 {value!r}") from None
+
+BACKUP_AT = _parse_at(os.getenv("BACKUP_AT", "03:30"))
+
+_CHUNK = 1 << 20
+_TABLES = ("chat_settings", "checkins", "work_sessions", "breaks")
+
+LAST_SUCCESS = metrics.gauge("bot_backup_last_success_timestamp", "最近一次备份成功时间")
+LAST_BYTES = metrics.gauge("bot_backup_last_size_bytes", "最近一次备份压缩后大小")
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _prefix(db_path: str) -> str:
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+# ===== 备份 =====
+def _copy_online(db_path: str, dst_path: str, pages: int, pause_s: float) -> int:
+    """逐步复制到未压缩的临时文件，返回步数"""
+    src = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if pause_s and remaining:
+            time.sleep(pause_s)  # 步间让出，写入方拿锁/checkpoint 不用等整份复制完
+
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()  # 开启读事务，固定快照
+        src.backup(dst, pages=pages, progress=progress)
+        src.execute("ROLLBACK")
+    finally:
+        dst.close()
+        src.close()
+    return steps
+
+def _compress(src_path: str, gz_path: str, inner_name: str) -> str:
+    """gzip 压缩，返回压缩文件的 sha256；inner_name 是 gzip 头里记录的原文件名（gunzip 解出来的名字）"""
+    with open(src_path, "rb") as fin, open(gz_path, "wb") as raw:
+        with gzip.GzipFile(filename=inner_name, mode="wb", fileobj=raw, compresslevel=6) as gz:
+            shutil.copyfileobj(fin, gz, _CHUNK)
+    return _sha256_file(gz_path)
+
+def rotate(backup_dir: str, prefix: str, keep: int) -> List[str]:
+    """只保留最近 keep 份，返回删除的文件"""
+    files = sorted(glob.glob(os.path.join(backup_dir, f"{prefix}-*.db.gz")))
+    removed = []
+    for path in files[:-keep] if keep > 0 else []:
+        for p in (path, path + ".sha256"):
+            if os.path.exists(p):
+                os.remove(p); removed.append(p)
+    return removed
+
+def backup_now(db_path: Optional[str] = None, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+               pages: int = BACKUP_PAGES, pause_ms: float = BACKUP_STEP_PAUSE_MS) -> Dict[str, object]:
+    db_path = db_path or storage.DB_PATH
+    os.makedirs(backup_dir, exist_ok=True)
+    prefix = _prefix(db_path)
+    t0 = time.perf_counter()
+    # 文件名带微秒，并用 O_EXCL 占住 .part：同一秒（甚至同一微秒）里的两次备份不会互相覆盖
+    while True:
+        gz_path = os.path.join(backup_dir, f"{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db.gz")
+        try:
+            os.close(os.open(gz_path + ".part", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            continue
+        if not os.path.exists(gz_path):
+            break
+        os.remove(gz_path + ".part")
+
+    fd, tmp = tempfile.mkstemp(prefix=f".{prefix}-", suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        steps = _copy_online(db_path, tmp, pages, pause_ms / 1000)
+        copy_s = time.perf_counter() - t0
+        digest = _compress(tmp, gz_path + ".part", os.path.basename(gz_path)[:-len(".gz")])
+        with open(gz_path + ".sha256", "w") as f:
+            f.write(f"{digest}  {os.path.basename(gz_path)}\n")
+        os.replace(gz_path + ".part", gz_path)  # 写完（含 .sha256）才出现正式文件名，rotate/verify 不会看到半截文件
+    finally:
+        leftovers = (tmp, gz_path + ".part") if os.path.exists(gz_path) else (tmp, gz_path + ".part", gz_path + ".sha256")
+        for p in leftovers:
+            if os.path.exists(p): os.remove(p)
+
+    removed = rotate(backup_dir, prefix, keep)
+    size = os.path.getsize(gz_path)
+    LAST_SUCCESS.set(time.time()); LAST_BYTES.set(size)
+    return {"path": gz_path, "bytes": size, "steps": steps, "copy_s": round(copy_s, 2),
+            "total_s": round(time.perf_counter() - t0, 2), "rotated": len(removed)}
+
+async def run_backup(**kwargs) -> Dict[str, object]:
+    return await asyncio.to_thread(backup_now, **kwargs)
+
+# ===== 校验 / 恢复 =====
+def _expected_digest(gz_path: str) -> Optional[str]:
+    side = gz_path + ".sha256"
+    if not os.path.exists(side):
+        return None
+    with open(side) as f:
+        return f.read().split()[0]
+
+def _decompress(gz_path: str, dst_path: str):
+    with gzip.open(gz_path, "rb") as fin, open(dst_path, "wb") as fout:
+        shutil.copyfileobj(fin, fout, _CHUNK)
+
+def verify(gz_path: str) -> Tuple[bool, List[str]]:
+    """哈希 + 解压 + integrity_check + 行数；返回 (是否通过, 说明)"""
+    notes = []
+    expected = _expected_digest(gz_path)
+    if expected is None:
+        return False, [f"缺少校验文件 {gz_path}.sha256"]
+    actual = _sha256_file(gz_path)
+    if actual != expected:
+        return False, [f"sha256 不一致：{actual} != {expected}"]
+    notes.append("sha256 ok")
+
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(gz_path)))
+    os.close(fd)
+    try:
+        _decompress(gz_path, tmp)
+        con = sqlite3.connect(f"file:{quote(tmp)}?mode=ro", uri=True)
+        try:
+            res = con.execute("PRAGMA integrity_check").fetchone()[0]
+            if res != "ok":
+                return False, notes + [f"integrity_check: {res}"]
+            notes.append("integrity_check ok")
+            for table in _TABLES:
+                n = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                notes.append(f"{table}: {n} 行")
+        finally:
+            con.close()
+    finally:
+        os.remove(tmp)
+    return True, notes
+
+def restore(gz_path: str, target: str, force: bool = False):
+    """校验通过后解压到 target（bot 须已停止）；-wal/-shm 一并清掉，避免旧日志被重放到新库上"""
+    ok, notes = verify(gz_path)
+    if not ok:
+        raise SystemExit("校验失败，未恢复：" + "；".join(notes))
+    if os.path.exists(target) and not force:
+        raise SystemExit(f"{target} 已存在（确认 bot 已停止后加 --force 覆盖）")
+    tmp = target + ".restore"
+    _decompress(gz_path, tmp)
+    con = sqlite3.connect(tmp)
+    try:
+        storage.bump_data_epoch(con)  # 换新的数据版本：即便有进程还留着报表缓存，也不会命中恢复前的结果
+        con.commit()
+    finally:
+        con.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(target + suffix): os.remove(target + suffix)
+    os.replace(tmp, target)
+
+def _cli(argv=None):
+    p = argparse.ArgumentParser(prog="python -m app.backup")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    now = sub.add_parser("now", help="立即做一次在线备份")
+    now.add_argument("--db", default=os.getenv("DB_PATH", "data.db"))
+    now.add_argument("--dir", default=BACKUP_DIR)
+    now.add_argument("--keep", type=int, default=BACKUP_KEEP)
+    ve = sub.add_parser("verify", help="校验备份文件")
+    ve.add_argument("file")
+    re_ = sub.add_parser("restore", help="从备份恢复（先停 bot）")
+    re_.add_argument("file")
+    re_.add_argument("--to", default=os.getenv("DB_PATH", "data.db"))
+    re_.add_argument("--force", action="store_true")
+    args = p.parse_args(argv)
+
+    if args.cmd == "now":
+        r = backup_now(args.db, args.dir, args.keep)
+        print(f"{r['path']}: {r['bytes']} 字节，{r['steps']} 步，复制 {r['copy_s']}s，共 {r['total_s']}s，轮换删除 {r['rotated']} 份")
+    elif args.cmd == "verify":
+        ok, notes = verify(args.file)
+        print("\n".join(notes))
+        if not ok:
+            raise SystemExit(1)
+    else:
+        restore(args.file, args.to, args.force)
+        print(f"已恢复到 {args.to}")
+
+if __name__ == "__main__":
+    _cli()
@@ -0,0 +1,240 @@
+# app/import.py
+"""
+历史考勤批量导入（从表格迁移过来的团队）：
+
+python -m app.import history.csv [more.csv ...] [--chat -100123] [--tz America/New_York] [--dry-run]
+python -m app.import - < history.csv
+
+CSV 表头（列顺序不限，多余列忽略）：
+  type          checkin / work / smoke / toilet / takeout（也认 签到/上班/抽烟/如厕/取外卖）
+  chat_id       没有这一列时用 --chat
+  user_id       必填
+  username, display_name   可选（签到记录里用于日报显示名）
+  start         签到时间 / 开始时间
+  end           结束时间（上班/休息必填；签到忽略）
+
+时间格式：unix 秒（或毫秒）、`2026-09-01 09:00[:00]`、带偏移的 ISO 8601。
+不带时区的按该群配置的时区解释（未配置用 --tz，默认美东），与 bot 的“按当地日切分”一致。
+
+- 逐行流式读取，每 --commit-every 行（默认 5000）executemany 进内存临时表，再开一个短的 BEGIN IMMEDIATE
+  合并进正式表：解析和写临时表都不占主库写锁，只有合并那一下持锁（几十毫秒），bot 的写入最多等这么久；
+  内存占用与文件大小无关
+- 可重复导入：按自然键去重（签到 chat_id+user_id+ts；上班 chat_id+user_id+start；休息再加 kind），
+  库里已有的、同一文件里重复的都跳过；去重走正式表现有的索引，导入期间索引不删，bot 可以照常写库
+- 不带时区的时间落在夏令时切换处（不存在或有歧义的当地时间）时拒绝该行，请改用带偏移的格式
+- 坏行跳过并报告行号；先用 --dry-run 校验；结束后 ANALYZE（限定采样行数，持锁时间有上限）
+- 导入结束时更新库里的 data_epoch，运行中 bot 的区间报表缓存随之失效，不用重启
+"""
+import argparse, asyncio, csv, io, os, sqlite3, sys, time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytz
+
+from . import settings, storage
+
+_TYPES = {
+    "checkin": "checkin", "签到": "checkin",
+    "work": "work", "上班": "work",
+    "smoke": "smoke", "抽烟": "smoke", "吸烟": "smoke",
+    "toilet": "toilet", "如厕": "toilet", "上厕所": "toilet",
+    "takeout": "takeout", "取外卖": "takeout",
+}
+# 表 -> (列, 自然键)；先进临时表 stage_<表>（自然键唯一，文件内重复直接忽略），再合并掉库里已有的
+_TABLES = {
+    "checkins":      (("chat_id", "user_id", "username", "display_name", "ts"), ("chat_id", "user_id", "ts")),
+    "work_sessions": (("chat_id", "user_id", "start_ts", "end_ts"),            ("chat_id", "user_id", "start_ts")),
+    "breaks":        (("chat_id", "user_id", "kind", "start_ts", "end_ts"),    ("chat_id", "user_id", "kind", "start_ts")),
+}
+MAX_SPAN = 24 * 3600         # 单次上班/休息不超过 24 小时
+MIN_TS = 946684800           # 2000-01-01，早于此视为格式错误
+PROGRESS_EVERY = 500000      # 每多少行打印一次进度
+
+class RowError(ValueError):
+    pass
+
+# ===== 解析 =====
+def parse_ts(raw: str, tz: pytz.BaseTzInfo) -> int:
+    s = raw.strip()
+    if not s:
+        raise RowError("时间为空")
+    if s.isdigit():
+        ts = int(s)
+        if ts > 10 ** 11:  # 毫秒
+            ts //= 1000
+    else:
+        try:
+            dt = datetime.fromisoformat(s.replace("/", "-").replace("T", " "))
+        except ValueError:
+            raise RowError(f"无法识别的时间：{s}")
+        if not dt.tzinfo:
+            try:
+                dt = tz.localize(dt, is_dst=None)  # 默认的 is_dst=False 会把不存在/有歧义的时间悄悄挪一小时
+            except pytz.exceptions.NonExistentTimeError:
+                raise RowError(f"当地时间不存在（夏令时跳过的一小时）：{s}")
+            except pytz.exceptions.AmbiguousTimeError:
+                raise RowError(f"当地时间有歧义（夏令时回拨的一小时），请带偏移：{s}")
+        ts = int(dt.timestamp())
+    if not MIN_TS <= ts <= time.time() + 86400:
+        raise RowError(f"时间超出范围：{s}")
+    return ts
+
+class _Normalizer:
+    """一行 CSV -> (表名, 参数元组)；各群时区只查一次"""
+
+    def __init__(self, con: sqlite3.Connection, default_tz: str, default_chat: Optional[int]):
+        self.default_tz = pytz.timezone(default_tz)
+        self.default_chat = default_chat
+        self.chat_tz: Dict[int, pytz.BaseTzInfo] = {
+            chat_id: pytz.timezone(tz) for chat_id, tz in con.execute("SELECT chat_id, tz FROM chat_settings WHERE tz IS NOT NULL")
+        }
+
+    def __call__(self, row: Dict[str, str]) -> Tuple[str, tuple]:
+        kind = _TYPES.get((row.get("type") or "").strip().lower())
+        if kind is None:
+            raise RowError(f"未知类型：{row.get('type')!r}")
+        try:
+            chat_raw = (row.get("chat_id") or "").strip()
+            chat_id = int(chat_raw) if chat_raw else self.default_chat
+            user_id = int((row.get("user_id") or "").strip())
+        except ValueError:
+            raise RowError("chat_id/user_id 不是整数")
+        if chat_id is None:
+            raise RowError("缺少 chat_id（或用 --chat 指定）")
+
+        tz = self.chat_tz.get(chat_id, self.default_tz)
+        start = parse_ts(row.get("start") or "", tz)
+        if kind == "checkin":
+            return "checkins", (chat_id, user_id, (row.get("username") or "").strip() or None,
+                                (row.get("display_name") or "").strip() or None, start)
+        end = parse_ts(row.get("end") or "", tz)
+        if not start < end <= start + MAX_SPAN:
+            raise RowError("结束时间须晚于开始且间隔不超过 24 小时")
+        if kind == "work":
+            return "work_sessions", (chat_id, user_id, start, end)
+        return "breaks", (chat_id, user_id, kind, start, end)
+
+def _iter_csv(paths: List[str]) -> Iterator[Tuple[str, int, Dict[str, str]]]:
+    """(文件名, 行号, 行)；表头统一小写"""
+    for path in paths:
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="") if path == "-" \
+            else open(path, newline="", encoding="utf-8-sig")
+        with f:
+            reader = csv.reader(f)
+            header = [h.strip().lower() for h in next(reader, [])]
+            for row in reader:
+                if row:
+                    yield path, reader.line_num, dict(zip(header, row))
+
+# ===== 临时表 / 合并 =====
+def _create_stage(con: sqlite3.Connection):
+    for table, (cols, key) in _TABLES.items():
+        con.execute(f"CREATE TEMP TABLE IF NOT EXISTS stage_{table} ({', '.join(cols)}, UNIQUE({', '.join(key)}))")
+
+def _stage_sql(table: str) -> str:
+    cols = _TABLES[table][0]
+    return f"INSERT OR IGNORE INTO stage_{table}({', '.join(cols)}) VALUES({','.join('?' * len(cols))})"
+
+def _merge(con: sqlite3.Connection, table: str) -> int:
+    """临时表 -> 正式表，库里已有同一自然键的跳过；返回实际插入行数"""
+    cols, key = _TABLES[table]
+    match = " AND ".join(f"t.{k} = s.{k}" for k in key)
+    cur = con.execute(
+        f"INSERT INTO {table}({', '.join(cols)}) SELECT {', '.join('s.' + c for c in cols)} FROM stage_{table} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})"
+    )
+    con.execute(f"DELETE FROM stage_{table}")
+    return cur.rowcount
+
+# ===== 导入 =====
+def run_import(db_path: str, paths: List[str], *, tz: str = settings.DEFAULT_TZ_NAME, chat: Optional[int] = None,
+               commit_every: int = 5000, dry_run: bool = False, max_errors: int = 20, out=sys.stderr) -> Dict[str, int]:
+    asyncio.run(storage.init_db(db_path))
+    con = sqlite3.connect(db_path, isolation_level=None)
+    con.execute("PRAGMA synchronous=NORMAL")  # WAL 下只在 checkpoint 时 fsync
+    con.execute("PRAGMA temp_store=MEMORY")   # 临时表放内存，每次合并后清空
+    con.execute("PRAGMA cache_size=-65536")   # 64MB 页缓存
+    normalize = _Normalizer(con, tz, chat)
+    _create_stage(con)
+
+    counts = {t: 0 for t in _TABLES}
+    counts["duplicates"] = counts["skipped"] = 0
+    buf: Dict[str, List[tuple]] = {t: [] for t in _TABLES}
+    parsed = pending = 0
+    t0 = time.perf_counter()
+
+    def merge():
+        """写临时表（自动提交，不碰主库的锁），再在一个短的写事务里合并进正式表"""
+        for table, rows in buf.items():
+            if rows:
+                con.executemany(_stage_sql(table), rows)
+                rows.clear()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for table in _TABLES:
+                counts[table] += _merge(con, table)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")  # 只回滚这一批；之前的批次已落盘，重跑时按自然键跳过
+            raise
+        counts["duplicates"] = parsed - sum(counts[t] for t in _TABLES)
+
+    try:
+        for path, line, row in _iter_csv(paths):
+            try:
+                table, params = normalize(row)
+            except RowError as e:
+                counts["skipped"] += 1
+                if counts["skipped"] <= max_errors:
+                    print(f"{path}:{line}: {e}", file=out)
+                continue
+            parsed += 1
+            if dry_run:
+                counts[table] += 1
+                continue
+            buf[table].append(params)
+            pending += 1
+            if pending >= commit_every:
+                merge()
+                pending = 0
+            if parsed % PROGRESS_EVERY == 0:
+                print(f"… {parsed} rows, {parsed / (time.perf_counter() - t0):,.0f} rows/s", file=out)
+        if not dry_run:
+            merge()
+    finally:
+        load_s = time.perf_counter() - t0
+        if not dry_run:
+            storage.bump_data_epoch(con)  # 之前的批次已提交，中途失败也要让报表缓存失效
+            t1 = time.perf_counter()
+            con.execute("PRAGMA analysis_limit=1000")  # 每个索引只采样这么多行，ANALYZE 持锁时间与库大小无关
+            con.execute("ANALYZE")  # 刷新查询规划器统计
+            print(f"analyze in {time.perf_counter() - t1:.1f}s", file=out)
+        con.close()
+
+    counts["rows_per_s"] = int(parsed / load_s) if load_s > 0 else parsed
+    return counts
+
+def _cli(argv=None):
+    p = argparse.ArgumentParser(prog="python -m app.import", description="从 CSV 批量导入历史考勤")
+    p.add_argument("files", nargs="+", help="CSV 文件，- 表示标准输入")
+    p.add_argument("--db", default=os.getenv("DB_PATH", "data.db"))
+    p.add_argument("--tz", default=settings.DEFAULT_TZ_NAME, help="群未配置时区时使用（默认美东）")
+    p.add_argument("--chat", type=int, help="CSV 没有 chat_id 列时，全部导入到这个群")
+    p.add_argument("--commit-every", type=int, default=5000,
+                   help="每次合并进正式表的行数（合并期间持写锁，越小 bot 等锁越短）")
+    p.add_argument("--max-errors", type=int, default=20, help="最多打印多少条坏行")
+    p.add_argument("--dry-run", action="store_true", help="只校验，不写库")
+    args = p.parse_args(argv)
+
+    try:
+        settings.parse_tz(args.tz)
+    except ValueError as e:
+        p.error(str(e))
+    counts = run_import(args.db, args.files, tz=args.tz, chat=args.chat, commit_every=args.commit_every,
+                        dry_run=args.dry_run, max_errors=args.max_errors)
+    verb = "校验通过" if args.dry_run else "导入"
+    print(f"{verb}：签到 {counts['checkins']}，上班 {counts['work_sessions']}，休息 {counts['breaks']}，"
+          f"已存在/重复 {counts['duplicates']} 行，跳过 {counts['skipped']} 行；{counts['rows_per_s']:,} rows/s")
+
+if __name__ == "__main__":
+    _cli()
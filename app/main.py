@@ -1,20 +1,25 @@
-import asyncio, os, logging, re
-from datetime import datetime, timedelta, timezone, time as dtime
+import time
+_BOOT_T0 = time.perf_counter()  # 冷启动计时起点（含下面的 import）
+import asyncio, csv, hashlib, io, json, os, logging, re, tempfile
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone, time as dtime
 import pytz, uvicorn
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
     ReplyKeyboardMarkup, KeyboardButton, ChatMember, ChatMemberAdministrator, ChatMemberOwner
 )
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler, ContextTypes,
-    AIORateLimiter, MessageHandler, filters
+    MessageHandler, filters
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, Forbidden, NetworkError
 
-from . import storage
+from . import storage, shard, metrics, profiling, settings, outbound, polling, backup
 from .utils import t
+from .outbound import SCHEDULED, BULK
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("pro-bot")
@@ -24,33 +29,29 @@ BASE_URL = os.getenv("BASE_URL")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "dev-secret")
 ENABLE_POLLING = os.getenv("ENABLE_POLLING", "false").lower() == "true"
 PORT = int(os.getenv("PORT", "8000"))
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL")  # 自建 Bot API / 压测桩，形如 http://127.0.0.1:8081/bot
+OUTBOUND_POOL_SIZE = int(os.getenv("OUTBOUND_POOL_SIZE", "64"))  # Bot API 长连接数
 
-# ===== 固定配置：美东时区 & 日程 =====
-TZ_ET = pytz.timezone("America/New_York")
-DAILY_GREETING_ET = dtime(8, 50, 0, tzinfo=TZ_ET)
-
-# 工作时间：Mon–Fri 9:00–22:00（提醒/快照用），周末不固定
-WORK_SCHEDULE = {
-    0: (9, 0, 22, 0),  # Mon
-    1: (9, 0, 22, 0),  # Tue
-    2: (9, 0, 22, 0),  # Wed
-    3: (9, 0, 22, 0),  # Thu
-    4: (9, 0, 22, 0),  # Fri
-    5: (0, 0, 0, 0),   # Sat - 不用于提醒
-    6: (0, 0, 0, 0),   # Sun - 不用于提醒
-}
+# ===== 日程 =====
+# 时区 / 工作日程 / 休息限制 / 语言 按群配置，默认值见 settings.py
+DAILY_GREETING = dtime(8, 50, 0)  # 群所在时区
 REMIND_BEFORE_MIN = 5
 SNAPSHOT_BEFORE_MIN = 3  # 下班前 3 分钟快照
-
-# 休息限制
-SMOKE_LIMIT_MIN = 10
-SMOKE_MAX_PER_DAY = 10
-TOILET_LIMIT_MIN = 15
-TOILET_MAX_PER_DAY = 5
-TAKEOUT_LIMIT_MIN = 15
-TAKEOUT_MAX_PER_DAY = 3
 PENALTY_MIN = 5
 
+# 日报：Telegram 单条消息上限 4096 字符，分段时留余量
+REPORT_CHUNK_CHARS = 3800
+REPORT_TABLE_HEAD = ["姓名 | 上班时长(h) | 厕所 | 外卖", "---|---:|---:|---:"]
+REPORT_DOCUMENT_THRESHOLD = int(os.getenv("REPORT_DOCUMENT_THRESHOLD", "300"))  # 超过该人数改发 CSV 附件
+REPORT_MEMBER_LOOKUP_MAX = 80  # 不超过该人数时才逐个查群内昵称（每人一次 API 调用）
+
+BREAK_NAMES = {"smoke": "吸烟", "toilet": "如厕", "takeout": "取外卖"}
+
+# 组织汇总：所有群合并的日/周视图，发到管理群（未配置则只走 HTTP）
+ORG_ADMIN_CHAT_ID = int(os.environ["ORG_ADMIN_CHAT_ID"]) if os.getenv("ORG_ADMIN_CHAT_ID") else None
+ORG_TOP_N = int(os.getenv("ORG_TOP_N", "10"))
+ORG_REPORT_AT = dtime(22, 30)  # 美东；周报在周日同一时间、日报之后发
+
 # ===== UI =====
 def kbd_checkin(lang):
     return InlineKeyboardMarkup([[InlineKeyboardButton(t(lang, "btn_checkin"), callback_data="checkin")]])
@@ -75,16 +76,29 @@ WELCOME_TEXT = (
     "• 厕所/取外卖 ≤15 分钟，超时需领取处罚。\n"
 )
 
-def greeting_text():
+def greeting_text(cfg: settings.ChatSettings):
+    """按群的日程和时区写打卡截止时间；不固定的日子（默认周末）不写"""
+    wd = cfg.now().weekday()
+    if cfg.is_workday(wd):
+        sh, sm, _, _ = cfg.schedule[wd]
+        deadline = f"记得在 {sh:02d}:{sm:02d}（{cfg.tz_label}）前打卡哦～\n"
+    else:
+        deadline = "今天时间不固定，以实际打卡为准～\n"
     return (
         "⏰ 早上好！今天继续努力工作，冲业绩、赚大钱！💸\n"
-        "记得在 09:00 前打卡哦～\n"
+        + deadline +
         "快捷：上班打卡/下班打卡、上厕所/拉完了、取外卖/回座。"
     )
 
 # ===== 工具函数 =====
-async def ensure_db(): await storage.init_db()
-async def get_lang(chat_id:int) -> str: return await storage.get_lang(chat_id)
+_db_ready = False
+
+async def ensure_db():
+    global _db_ready
+    if not _db_ready:
+        await storage.init_db(); _db_ready = True
+
+async def get_lang(chat_id:int) -> str: return (await settings.get(chat_id)).lang
 def is_admin_status(m: ChatMember) -> bool: return isinstance(m,(ChatMemberAdministrator,ChatMemberOwner))
 
 def _next_weekly_occurrence(weekday: int, hh: int, mm: int, tz: pytz.BaseTzInfo) -> datetime:
@@ -95,15 +109,6 @@ def _next_weekly_occurrence(weekday: int, hh: int, mm: int, tz: pytz.BaseTzInfo)
     if target <= now_local: target += timedelta(days=7)
     return target.astimezone(timezone.utc)
 
-def _et_day_bounds(dt_et: datetime):
-    start_local = TZ_ET.localize(datetime(dt_et.year, dt_et.month, dt_et.day, 0, 0, 0))
-    end_local = start_local + timedelta(days=1) - timedelta(seconds=1)
-    return int(start_local.timestamp()), int(end_local.timestamp()), start_local, end_local
-
-def _today_window_et():
-    now_et = datetime.now(TZ_ET)
-    return _et_day_bounds(now_et)
-
 def _next_daily_time(hh: int, mm: int, tz: pytz.BaseTzInfo) -> datetime:
     """返回下一次在 tz 时区的 hh:mm（今天未过则今天；否则明天），UTC 时间戳"""
     now_local = datetime.now(tz)
@@ -133,14 +138,13 @@ async def _reschedule_active_breaks(app: Application):
     if not rows:
         return
 
-    # 上限表
-    LIMITS = {"smoke": SMOKE_LIMIT_MIN, "toilet": TOILET_LIMIT_MIN, "takeout": TAKEOUT_LIMIT_MIN}
-    name_map = {"smoke": "吸烟", "toilet": "如厕", "takeout": "取外卖"}
-
     now_utc = datetime.now(timezone.utc)
 
     for chat_id, user_id, kind, start_ts in rows:
-        limit_min = LIMITS.get(kind, 15)
+        name = f"limit-{kind}-{chat_id}-{user_id}"
+        if app.job_queue.get_jobs_by_name(name):
+            continue  # 开始服务后才恢复：这期间新开始的休息已经由 _start_break 排好了提醒
+        limit_min, _ = (await settings.get(chat_id)).limit(kind)
         passed = (int(now_utc.timestamp()) - int(start_ts)) // 60
         if passed >= limit_min:
             # 已超时：补发一次提醒
@@ -148,8 +152,9 @@ async def _reschedule_active_breaks(app: Application):
                 mention = f'<a href="tg://user?id={user_id}">请尽快回座</a>'
                 await app.bot.send_message(
                     chat_id=chat_id,
-                    text=f"⏰ {name_map.get(kind, kind)}已超过 {limit_min} 分钟，{mention}。超时将记录处罚。",
+                    text=f"⏰ {BREAK_NAMES.get(kind, kind)}已超过 {limit_min} 分钟，{mention}。超时将记录处罚。",
                     parse_mode="HTML",
+                    rate_limit_args=SCHEDULED,
                 )
             except Exception as e:
                 logging.warning(f"resume overdue notify fail: {e}")
@@ -161,7 +166,7 @@ async def _reschedule_active_breaks(app: Application):
                     break_limit_job,
                     when=now_utc + timedelta(minutes=remaining),
                     chat_id=chat_id,
-                    name=f"limit-{kind}-{chat_id}-{user_id}",
+                    name=name,
                     data={"chat_id": chat_id, "user_id": user_id, "kind": kind, "limit_min": limit_min},
                 )
             except Exception as e:
@@ -169,25 +174,29 @@ async def _reschedule_active_breaks(app: Application):
 
 
 # ===== 计划任务 =====
+@metrics.timed_job("daily_greeting_job")
 async def daily_greeting_job(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data["chat_id"]
-    await context.bot.send_message(chat_id=chat_id, text=greeting_text())
+    await context.bot.send_message(chat_id=chat_id, text=greeting_text(await settings.get(chat_id)), rate_limit_args=BULK)
 
+@metrics.timed_job("work_reminder_job")
 async def work_reminder_job(context: ContextTypes.DEFAULT_TYPE):
     d = context.job.data
     chat_id, kind, h, m = d["chat_id"], d["kind"], d["h"], d["m"]
-    when = f"{h:02d}:{m:02d} ET"
+    cfg = await settings.get(chat_id)
+    when = f"{h:02d}:{m:02d} {cfg.tz_label}"
     encourage = "今天冲一冲，目标翻倍！💪"
     if kind == "start":
-        txt = f"⏰ {when} 即将上班（还有 {REMIND_BEFORE_MIN} 分钟）— 记得 09:00 前打卡！{encourage}"
+        txt = f"⏰ {when} 即将上班（还有 {REMIND_BEFORE_MIN} 分钟）— 记得 {h:02d}:{m:02d} 前打卡！{encourage}"
     else:
         txt = f"⏰ {when} 即将下班（还有 {REMIND_BEFORE_MIN} 分钟）— 记得收尾并『下班打卡』！{encourage}"
-    await context.bot.send_message(chat_id=chat_id, text=txt)
+    await context.bot.send_message(chat_id=chat_id, text=txt, rate_limit_args=BULK)
 
+@metrics.timed_job("snapshot_job")
 async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
     """下班前 3 分钟快照"""
     chat_id = context.job.data["chat_id"]
-    start_ts, end_ts, start_local, _ = _today_window_et()
+    start_ts, end_ts, start_local, _ = (await settings.get(chat_id)).today()
     # 粗略快照：人数 + 如厕/外卖次数
     c, _, _, t_cnt, _, top = await storage.summarize_between(chat_id, start_ts, end_ts)
     top_text = "、".join([f"{name}:{cnt}" for (name, cnt) in top]) if top else "（无）"
@@ -198,85 +207,149 @@ async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
         f"• Top 打卡：{top_text}\n"
         f"下班后三分钟将推送正式日报～"
     )
-    await context.bot.send_message(chat_id=chat_id, text=txt)
+    await context.bot.send_message(chat_id=chat_id, text=txt, rate_limit_args=BULK)
 
-async def send_daily_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int, ref_et: datetime):
-    """
-    日报：按人统计
-    - 姓名：优先取群内的显示名（get_chat_member → user.full_name）
-    - 指标：上班时长(小时, 两位小数) / 厕所次数 / 取外卖次数
-    - 优先私发群主；私发失败则发回群里
-    """
-    # 统计区间（当天 ET）
-    start_ts, end_ts, start_local, _ = _et_day_bounds(ref_et)
-    rows = await storage.daily_person_summary(chat_id, start_ts, end_ts)
-    if not rows:
-        await context.bot.send_message(chat_id=chat_id, text="📈 今日无数据")
-        return
-
-    # 先拿群主（用于私发）
-    owner_id = None
+async def _chat_owner_id(bot, chat_id: int) -> Optional[int]:
     try:
-        admins = await context.bot.getChatAdministrators(chat_id)
+        admins = await bot.getChatAdministrators(chat_id, rate_limit_args=BULK)
         for a in admins:
             if isinstance(a, ChatMemberOwner):
-                owner_id = a.user.id
-                break
+                return a.user.id
     except Exception as e:
         logging.warning(f"getChatAdministrators failed: {e}")
+    return None
 
-    # 组装表格（姓名改为群内昵称）
-    lines = [
-        f"📈 今日统计报表（按人）",
-        f"日期：{start_local.strftime('%Y-%m-%d')}（ET）",
-        "",
-        "姓名 | 上班时长(h) | 厕所 | 外卖",
-        "---|---:|---:|---:",
-    ]
+async def _member_name(bot, chat_id: int, r: dict) -> str:
+    """群内显示名；查不到回退到存储里的 name"""
+    try:
+        member = await bot.get_chat_member(chat_id, r["user_id"], rate_limit_args=BULK)
+        return member.user.full_name or r["name"]
+    except Exception:
+        return r["name"]
 
-    # 为了减少 API 压力，查不到就回退到存储里的 name
-    for r in rows:
-        # 获取群内显示名
-        try:
-            member = await context.bot.get_chat_member(chat_id, r["user_id"])
-            name = member.user.full_name or r["name"] or str(r["user_id"])
-        except Exception:
-            name = r["name"] or str(r["user_id"])
+class _ReportSender:
+    """
+    优先私发群主；目的地在第一段发送时定下来，之后每段都发同一处，一份报表不会拆在私聊和群里。
+    私聊发不了（Forbidden/BadRequest，如群主没开过 bot）才改发群里；网络类错误原地重试。
+    """
+    RETRIES = 3
 
-        h = round(r["work_min"] / 60, 2)
-        lines.append(f"{name} | {h:.2f} | {r['toilet_cnt']} | {r['takeout_cnt']}")
+    def __init__(self, bot, owner_id: Optional[int], chat_id: int):
+        self.bot = bot
+        self.targets = [owner_id, chat_id] if owner_id else [chat_id]
+        self.fixed = False
 
-    text = "\n".join(lines)
+    async def send(self, method: str, **kwargs):
+        for attempt in range(1, self.RETRIES + 1):
+            if "document" in kwargs:
+                kwargs["document"].seek(0)
+            try:
+                res = await getattr(self.bot, method)(self.targets[0], **kwargs)
+                self.fixed = True
+                return res
+            except (Forbidden, BadRequest) as e:
+                if self.fixed or len(self.targets) == 1:
+                    raise
+                logging.warning(f"send_daily_report private fail -> {e}")
+                self.targets.pop(0)
+                self.fixed = True
+                return await self.send(method, **kwargs)
+            except NetworkError as e:
+                if attempt == self.RETRIES:
+                    raise
+                logging.warning(f"send_daily_report retry {attempt} -> {e}")
+                await asyncio.sleep(attempt)
+
+async def render_report_chunks(title_lines, rows, name_of=None, limit: int = REPORT_CHUNK_CHARS):
+    """
+    把按人行（异步迭代）拼成不超过 limit 字符的消息段，边读边产出；每段都重复表头。
+    name_of(row) 可选，用于替换显示名（协程）。
+    """
+    parts = list(title_lines) + [""] + REPORT_TABLE_HEAD
+    size = sum(len(p) + 1 for p in parts)
+    fresh = True  # 当前段还没有数据行
+    async for r in rows:
+        name = (await name_of(r)) if name_of else r["name"]
+        h = round(r["work_min"] / 60, 2)
+        line = f"{name} | {h:.2f} | {r['toilet_cnt']} | {r['takeout_cnt']}"
+        if not fresh and size + len(line) + 1 > limit:
+            yield "\n".join(parts)
+            parts = list(REPORT_TABLE_HEAD)
+            size = sum(len(p) + 1 for p in parts)
+        parts.append(line)
+        size += len(line) + 1
+        fresh = False
+    yield "\n".join(parts)
+
+async def _aiter(items):
+    for x in items:
+        yield x
+
+async def _report_csv(rows):
+    """CSV 附件：逐行写入临时文件，内存占用与人数无关"""
+    raw = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    w = csv.writer(text)
+    w.writerow(["user_id", "姓名", "上班时长(h)", "厕所", "外卖"])
+    async for r in rows:
+        w.writerow([r["user_id"], r["name"], f"{r['work_min'] / 60:.2f}", r["toilet_cnt"], r["takeout_cnt"]])
+    text.flush(); text.detach()
+    raw.seek(0)
+    return raw
+
+async def send_daily_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int, ref_local: datetime):
+    """
+    日报：按人统计
+    - 姓名：小群（≤ REPORT_MEMBER_LOOKUP_MAX 人）取群内显示名（get_chat_member → user.full_name），大群直接用打卡时记录的名字
+    - 指标：上班时长(小时, 两位小数) / 厕所次数 / 取外卖次数
+    - 在只读快照里取完全部行（人数 ≤ REPORT_DOCUMENT_THRESHOLD）或写好 CSV 附件，关掉快照后再查昵称、分段发送
+    - 优先私发群主；私聊发不了则整份发回群里
+    """
+    # 统计区间（群所在时区的当天）
+    cfg = await settings.get(chat_id)
+    start_ts, end_ts, start_local, _ = cfg.day_bounds_for(ref_local)
+    day = start_local.strftime('%Y-%m-%d')
+    title = [f"📈 今日统计报表（按人）", f"日期：{day}（{cfg.tz_label}）"]
+
+    # 快照里只读库、把结果落成列表/临时文件，关掉快照再发（发送可能很慢，不能拖着读事务）
+    doc = None
+    async with storage.report_snapshot() as db:
+        total = await storage.count_daily_persons(chat_id, start_ts, end_ts, db)
+        if total:
+            rows = storage.iter_daily_person_summary(chat_id, start_ts, end_ts, db)
+            if total > REPORT_DOCUMENT_THRESHOLD:
+                doc = await _report_csv(rows)
+            else:
+                rows = [r async for r in rows]
+    if not total:
+        await context.bot.send_message(chat_id=chat_id, text="📈 今日无数据", rate_limit_args=BULK)
+        return
 
-    # 发送（优先私发群主；失败则发群里）
-    async def _safe_send(uid: int, content: str) -> bool:
+    sender = _ReportSender(context.bot, await _chat_owner_id(context.bot, chat_id), chat_id)
+    if doc is not None:
         try:
-            await context.bot.send_message(uid, content)
-            return True
-        except Exception as e:
-            logging.warning(f"send_daily_report private fail -> {e}")
-            return False
-
-    sent = False
-    if owner_id:
-        sent = await _safe_send(owner_id, text)
+            await sender.send("send_document", document=doc, filename=f"daily-report-{day}.csv",
+                              caption="\n".join(title + [f"共 {total} 人，明细见附件"]), rate_limit_args=BULK)
+        finally:
+            doc.close()
+        return
 
-    if not sent:
-        await context.bot.send_message(chat_id, text)
+    # 为了减少 API 压力，大群不逐个查群内昵称
+    name_of = (lambda r: _member_name(context.bot, chat_id, r)) if total <= REPORT_MEMBER_LOOKUP_MAX else None
+    # 边渲染边发：第一段不用等全部昵称查完，内存里也只有当前一段
+    async for chunk in render_report_chunks(title, _aiter(rows), name_of):
+        await sender.send("send_message", text=chunk, rate_limit_args=BULK)
 
 
+@metrics.timed_job("weekly_report_job")
 async def weekly_report_job(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data["chat_id"]
-    now_et = datetime.now(TZ_ET)
-    weekday = now_et.weekday()
-    monday = (now_et - timedelta(days=weekday)).replace(hour=0, minute=0, second=0, microsecond=0)
-    monday = TZ_ET.localize(datetime(monday.year, monday.month, monday.day, 0, 0, 0))
-    sunday_end = monday + timedelta(days=7) - timedelta(seconds=1)
-    start_ts, end_ts = int(monday.timestamp()), int(sunday_end.timestamp())
+    cfg = await settings.get(chat_id)
+    start_ts, end_ts, monday, sunday_end = cfg.this_week()
 
     c, s_cnt, s_min, t_cnt, t_min, top = await storage.summarize_between(chat_id, start_ts, end_ts)
     top_text = "\n".join([f"- {name}: {cnt}" for (name, cnt) in top]) if top else "（无）"
-    title = f"🧾 本周总结（{monday.strftime('%Y-%m-%d')} ~ {sunday_end.strftime('%Y-%m-%d')}，ET）"
+    title = f"🧾 本周总结（{monday.strftime('%Y-%m-%d')} ~ {sunday_end.strftime('%Y-%m-%d')}，{cfg.tz_label}）"
     body = (
         f"周内打卡：{c}\n"
         f"吸烟合计：{s_cnt} 次；{s_min} 分钟\n"
@@ -284,12 +357,12 @@ async def weekly_report_job(context: ContextTypes.DEFAULT_TYPE):
         f"Top 打卡：\n{top_text}\n\n"
         f"下周继续努力，冲业绩、赚大钱！💰"
     )
-    await context.bot.send_message(chat_id=chat_id, text=f"{title}\n\n{body}")
+    await context.bot.send_message(chat_id=chat_id, text=f"{title}\n\n{body}", rate_limit_args=BULK)
 
+@metrics.timed_job("daily_report_job")
 async def daily_report_job(context: ContextTypes.DEFAULT_TYPE):
     chat_id = context.job.data["chat_id"]
-    ref_et = datetime.now(TZ_ET)
-    await send_daily_report(context, chat_id, ref_et)
+    await send_daily_report(context, chat_id, (await settings.get(chat_id)).now())
 
 async def schedule_chat_jobs(app: Application, chat_id: int):
     # 清理旧任务
@@ -299,8 +372,11 @@ async def schedule_chat_jobs(app: Application, chat_id: int):
                        or j.name == f"weekly-{chat_id}"):
             j.schedule_removal()
 
+    cfg = await settings.get(chat_id)
+    tz = cfg.tz
+
     # 早安
-    first = _next_daily_time(DAILY_GREETING_ET.hour, DAILY_GREETING_ET.minute, TZ_ET)
+    first = _next_daily_time(DAILY_GREETING.hour, DAILY_GREETING.minute, tz)
     app.job_queue.run_repeating(
         daily_greeting_job,
         interval=24*3600,
@@ -309,75 +385,150 @@ async def schedule_chat_jobs(app: Application, chat_id: int):
         data={"chat_id": chat_id},
    ) 
 
-    # 周一~周五：上/下班提醒 + 下班前3分钟快照 + 下班日报
-    for wd, (sh, sm, eh, em) in WORK_SCHEDULE.items():
-        if wd >= 5:  # 周末不固定，不安排提醒
+    # 工作日：上/下班提醒 + 下班前3分钟快照 + 下班日报
+    for wd, (sh, sm, eh, em) in cfg.schedule.items():
+        if not cfg.is_workday(wd):  # 不固定的日子（默认周末）不安排提醒
             continue
         # 上班前 5 分钟
-        start_first = _next_weekly_occurrence(wd, sh, sm, TZ_ET) - timedelta(minutes=REMIND_BEFORE_MIN)
+        start_first = _next_weekly_occurrence(wd, sh, sm, tz) - timedelta(minutes=REMIND_BEFORE_MIN)
         app.job_queue.run_repeating(work_reminder_job, interval=7*24*3600, first=start_first,
                                     name=f"workrem-{chat_id}-start-{wd}",
                                     data={"chat_id": chat_id, "kind": "start", "h": sh, "m": sm})
         # 下班前 5 分钟
-        end_first = _next_weekly_occurrence(wd, eh, em, TZ_ET) - timedelta(minutes=REMIND_BEFORE_MIN)
+        end_first = _next_weekly_occurrence(wd, eh, em, tz) - timedelta(minutes=REMIND_BEFORE_MIN)
         app.job_queue.run_repeating(work_reminder_job, interval=7*24*3600, first=end_first,
                                     name=f"workrem-{chat_id}-end-{wd}",
                                     data={"chat_id": chat_id, "kind": "end", "h": eh, "m": em})
         # 下班前 3 分钟快照
-        snap_first = _next_weekly_occurrence(wd, eh, em, TZ_ET) - timedelta(minutes=SNAPSHOT_BEFORE_MIN)
+        snap_first = _next_weekly_occurrence(wd, eh, em, tz) - timedelta(minutes=SNAPSHOT_BEFORE_MIN)
         app.job_queue.run_repeating(snapshot_job, interval=7*24*3600, first=snap_first,
                                     name=f"snap-{chat_id}-{wd}", data={"chat_id": chat_id})
         # 下班即刻日报
-        end_exact = _next_weekly_occurrence(wd, eh, em, TZ_ET)
+        end_exact = _next_weekly_occurrence(wd, eh, em, tz)
         app.job_queue.run_repeating(daily_report_job, interval=7*24*3600, first=end_exact,
                                     name=f"dailyrep-{chat_id}-{wd}", data={"chat_id": chat_id})
 
+# ===== 组织汇总 =====
+_org_cfg = settings.compile_settings(0, None)  # 组织视图统一按默认时区（美东）切日/周
+
+def _org_bounds(period: str, day: Optional[date] = None) -> Tuple[int, int, datetime, datetime]:
+    ref = _org_cfg.tz.localize(datetime(day.year, day.month, day.day, 12)) if day else _org_cfg.now()
+    return _org_cfg.week_bounds_for(ref) if period == "week" else _org_cfg.day_bounds_for(ref)
+
+def _hm(minutes: int) -> str:
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+def _org_rollup_lines(r: Dict, title: str) -> List[str]:
+    lines = [title, f"群数：{r['chats']}；在岗人数：{r['headcount']}；上班合计：{_hm(r['work_min'])}"]
+    lines += [f"{BREAK_NAMES[k]}：{cnt} 次；{mins} 分钟" for k, (cnt, mins) in r["breaks"].items()]
+    if r["top"]:
+        lines.append(f"\n🏆 上班时长 Top {len(r['top'])}：")
+        lines += [f"{i}. {x['name']}（群 {x['chat_id']}）{_hm(x['work_min'])}" for i, x in enumerate(r["top"], 1)]
+    if r["per_chat"]:
+        lines.append("\n各群：人数 / 上班 / 吸烟·如厕·外卖(分钟)")
+        lines += [f"{c['chat_id']}：{c['headcount']} / {_hm(c['work_min'])} / "
+                  + "·".join(str(c["breaks"][k][1]) for k in storage.BREAK_KINDS) for c in r["per_chat"]]
+    return lines
+
+async def _send_lines(bot, chat_id: int, lines: List[str], limit: int = REPORT_CHUNK_CHARS):
+    buf, size = [], 0
+    for line in lines:
+        if buf and size + len(line) + 1 > limit:
+            await bot.send_message(chat_id, "\n".join(buf), rate_limit_args=BULK)
+            buf, size = [], 0
+        buf.append(line); size += len(line) + 1
+    if buf:
+        await bot.send_message(chat_id, "\n".join(buf), rate_limit_args=BULK)
+
+@metrics.timed_job("org_rollup_job")
+async def org_rollup_job(context: ContextTypes.DEFAULT_TYPE):
+    period = context.job.data["period"]
+    start_ts, end_ts, start_local, end_local = _org_bounds(period)
+    r = await storage.org_rollup(start_ts, end_ts, ORG_TOP_N)
+    span = start_local.strftime('%Y-%m-%d') if period == "day" else \
+        f"{start_local.strftime('%Y-%m-%d')} ~ {end_local.strftime('%Y-%m-%d')}"
+    title = f"🏢 组织{'日报' if period == 'day' else '周报'}（{span}，{_org_cfg.tz_label}）"
+    await _send_lines(context.bot, ORG_ADMIN_CHAT_ID, _org_rollup_lines(r, title))
+
+def schedule_org_rollup(app: Application):
+    # 分片模式下每个 worker 只有部分群的数据，组织汇总不适用
+    if ORG_ADMIN_CHAT_ID is None or shard.SHARD_INDEX is not None:
+        return
+    for name in ("org-daily", "org-weekly"):
+        for j in app.job_queue.get_jobs_by_name(name):
+            j.schedule_removal()
+    hh, mm = ORG_REPORT_AT.hour, ORG_REPORT_AT.minute
+    app.job_queue.run_repeating(org_rollup_job, interval=24*3600, first=_next_daily_time(hh, mm, _org_cfg.tz),
+                                name="org-daily", data={"period": "day"})
+    app.job_queue.run_repeating(org_rollup_job, interval=7*24*3600,
+                                first=_next_weekly_occurrence(6, hh, mm, _org_cfg.tz) + timedelta(minutes=1),
+                                name="org-weekly", data={"period": "week"})
+
+# ===== 备份 =====
+@metrics.timed_job("backup_job")
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    r = await backup.run_backup()  # 线程里分步复制，不阻塞打卡
+    log.info(f"backup ok: {r['path']} {r['bytes']}B in {r['total_s']}s ({r['steps']} steps, rotated {r['rotated']})")
+
+def schedule_backup(app: Application):
+    if backup.BACKUP_AT is None:
+        return
+    hh, mm = backup.BACKUP_AT.hour, backup.BACKUP_AT.minute
+    for j in app.job_queue.get_jobs_by_name("backup-daily"):
+        j.schedule_removal()
+    app.job_queue.run_repeating(backup_job, interval=24*3600, first=_next_daily_time(hh, mm, settings.DEFAULT_TZ),
+                                name="backup-daily")
+
 # ===== 命令 =====
+@metrics.timed_handler("start_cmd")
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await ensure_db()
     chat = update.effective_chat
     await update.message.reply_text(WELCOME_TEXT, reply_markup=reply_kbd_cn())
     await schedule_chat_jobs(context.application, chat.id)
 
+@metrics.timed_handler("checkin_cmd")
 async def checkin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """普通打卡（与上下班无关）"""
     await ensure_db()
     chat = update.effective_chat
     user = update.effective_user
-    lang = await get_lang(chat.id)
+    cfg = await settings.get(chat.id)
+    lang = cfg.lang
 
-    now_et = datetime.now(TZ_ET)
-    start_ts, end_ts, _, _ = _et_day_bounds(now_et)
+    start_ts, end_ts, _, _ = cfg.today()
 
     already = await storage.has_checkin_between(chat.id, user.id, start_ts, end_ts)
     if already:
-        await update.message.reply_text(t(lang, "checked_today", tz="ET"), reply_markup=reply_kbd_cn())
+        await update.message.reply_text(t(lang, "checked_today", tz=cfg.tz_label), reply_markup=reply_kbd_cn())
         return
 
     now_ts = int(datetime.now(timezone.utc).timestamp())
     await storage.add_checkin(chat.id, user.id, user.username or "", user.full_name, now_ts)
-    await update.message.reply_text(t(lang, "checkin_ok", tz="ET"), reply_markup=reply_kbd_cn())
+    await update.message.reply_text(t(lang, "checkin_ok", tz=cfg.tz_label), reply_markup=reply_kbd_cn())
 
 # ===== 上下班打卡（含时间窗、迟到、每日一次）=====
+@metrics.timed_handler("workin_cmd")
 async def workin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await ensure_db()
     chat = update.effective_chat
     user = update.effective_user
 
     # 每日只能一次
-    day_start, day_end, _, _ = _today_window_et()
+    cfg = await settings.get(chat.id)
+    day_start, day_end, _, _ = cfg.today()
     if await storage.work_started_between(chat.id, user.id, day_start, day_end):
         await update.message.reply_text("⚠️ 今天已经上过班啦（每天仅允许一次上班打卡）", reply_markup=reply_kbd_cn())
         return
 
-    # 时间窗判断（Mon–Fri 09:00之前正常；>09:00 迟到；周末无限制）
-    now_et = datetime.now(TZ_ET)
-    wd = now_et.weekday()
-    is_weekend = wd >= 5
+    # 时间窗判断（工作日上班时间之前正常；之后迟到；不固定的日子无限制）
+    now_local = cfg.now()
+    wd = now_local.weekday()
     late = False
-    if not is_weekend:
-        win_end   = now_et.replace(hour=9, minute=0,  second=0, microsecond=0)
-        if now_et > win_end:
+    if cfg.is_workday(wd):
+        sh, sm, _, _ = cfg.schedule[wd]
+        win_end   = now_local.replace(hour=sh, minute=sm,  second=0, microsecond=0)
+        if now_local > win_end:
             late = True
 
     # 开始上班
@@ -396,6 +547,7 @@ async def workin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(f"👋 早上好，{name}！上班加油，业绩长虹！🚀", reply_markup=reply_kbd_cn())
 
+@metrics.timed_handler("workout_cmd")
 async def workout_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await ensure_db()
     chat = update.effective_chat
@@ -409,13 +561,9 @@ async def workout_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # 今日/本周累计
-    now_et = datetime.now(TZ_ET)
-    day_start_ts, day_end_ts, _, _ = _et_day_bounds(now_et)
-    weekday = now_et.weekday()
-    monday = (now_et - timedelta(days=weekday)).replace(hour=0, minute=0, second=0, microsecond=0)
-    monday = TZ_ET.localize(datetime(monday.year, monday.month, monday.day, 0, 0, 0))
-    sunday_end = monday + timedelta(days=7) - timedelta(seconds=1)
-    week_start_ts, week_end_ts = int(monday.timestamp()), int(sunday_end.timestamp())
+    cfg = await settings.get(chat.id)
+    day_start_ts, day_end_ts, _, _ = cfg.today()
+    week_start_ts, week_end_ts, _, _ = cfg.this_week()
 
     day_total = await storage.work_minutes_between(chat.id, user.id, day_start_ts, day_end_ts)
     week_total = await storage.work_minutes_between(chat.id, user.id, week_start_ts, week_end_ts)
@@ -429,64 +577,64 @@ async def workout_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # ===== 休息（限时 + 限次 + 罚站 + 超时@提醒）=====
-async def _day_bounds_et():
-    now_local = datetime.now(TZ_ET)
-    start_local = TZ_ET.localize(datetime(now_local.year, now_local.month, now_local.day, 0, 0, 0))
-    end_local = start_local + timedelta(days=1) - timedelta(seconds=1)
-    return int(start_local.timestamp()), int(end_local.timestamp())
-
+@metrics.timed_handler("_start_break")
 async def _start_break(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
     chat = update.effective_chat; user = update.effective_user
     now_ts = int(datetime.now(timezone.utc).timestamp())
-    day_start, day_end = await _day_bounds_et()
-    max_per_day = SMOKE_MAX_PER_DAY if kind == "smoke" else TOILET_MAX_PER_DAY
+    cfg = await settings.get(chat.id)
+    day_start, day_end, _, _ = cfg.today()
+    limit_min, max_per_day = cfg.limit(kind)
     cnt = await storage.count_breaks_between(chat.id, user.id, kind, day_start, day_end)
     if cnt >= max_per_day:
         await update.message.reply_text(f"⚠️ 今日{ '吸烟' if kind=='smoke' else '如厕' }次数已达上限（{max_per_day} 次）"); return
     if await storage.has_active_break(chat.id, user.id, kind):
         await update.message.reply_text(f"已在{ '吸烟' if kind=='smoke' else '如厕' }中，先『拉完了/回座』再开始"); return
     await storage.start_break(chat.id, user.id, kind, now_ts)
-    await update.message.reply_text(f"⏱️ 开始{ '吸烟' if kind=='smoke' else '如厕' }休息（≤{TOILET_LIMIT_MIN if kind=='toilet' else SMOKE_LIMIT_MIN} 分钟）")
-    limit_min = SMOKE_LIMIT_MIN if kind == "smoke" else TOILET_LIMIT_MIN
+    await update.message.reply_text(f"⏱️ 开始{ '吸烟' if kind=='smoke' else '如厕' }休息（≤{limit_min} 分钟）")
     context.job_queue.run_once(break_limit_job, when=datetime.now(timezone.utc) + timedelta(minutes=limit_min),
         chat_id=chat.id, name=f"limit-{kind}-{chat.id}-{user.id}",
         data={"chat_id": chat.id, "user_id": user.id, "kind": kind, "limit_min": limit_min})
 
+@metrics.timed_handler("_stop_break")
 async def _stop_break(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
     chat = update.effective_chat; user = update.effective_user
     now_ts = int(datetime.now(timezone.utc).timestamp())
     mins = await storage.stop_break(chat.id, user.id, kind, now_ts)
     if mins is None:
         await update.message.reply_text("当前没有正在进行的休息"); return
-    limit_min = SMOKE_LIMIT_MIN if kind == "smoke" else (TAKEOUT_LIMIT_MIN if kind=="takeout" else TOILET_LIMIT_MIN)
-    name_cn = "吸烟" if kind=="smoke" else ("取外卖" if kind=="takeout" else "如厕")
+    limit_min, _ = (await settings.get(chat.id)).limit(kind)
+    name_cn = BREAK_NAMES.get(kind, kind)
     txt = f"✅ 结束{name_cn}，持续 {mins} 分钟"
     if mins > limit_min:
         txt += f"（已超过 {limit_min} 分钟）— 请主动联系组长领取对应处罚。"
         await update.message.reply_text(f"🚫 超时已记录：{name_cn} {mins} 分钟（上限 {limit_min}）")
         # 罚站
         await update.message.reply_text(f"现在开始罚站 {PENALTY_MIN} 分钟")
-        context.job_queue.run_once(lambda c: c.bot.send_message(chat.id, "⏳ 罚站结束，注意专注工作！"),
+        context.job_queue.run_once(lambda c: c.bot.send_message(chat.id, "⏳ 罚站结束，注意专注工作！", rate_limit_args=SCHEDULED),
                                    when=datetime.now(timezone.utc) + timedelta(minutes=PENALTY_MIN))
     await update.message.reply_text(txt)
 
 # 取外卖 / 回座
+@metrics.timed_handler("_start_takeout")
 async def _start_takeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kind = "takeout"
     chat = update.effective_chat; user = update.effective_user
     now_ts = int(datetime.now(timezone.utc).timestamp())
-    day_start, day_end = await _day_bounds_et()
+    cfg = await settings.get(chat.id)
+    day_start, day_end, _, _ = cfg.today()
+    limit_min, max_per_day = cfg.limit(kind)
     cnt = await storage.count_breaks_between(chat.id, user.id, kind, day_start, day_end)
-    if cnt >= TAKEOUT_MAX_PER_DAY:
-        await update.message.reply_text(f"⚠️ 今日取外卖次数已达上限（{TAKEOUT_MAX_PER_DAY} 次）"); return
+    if cnt >= max_per_day:
+        await update.message.reply_text(f"⚠️ 今日取外卖次数已达上限（{max_per_day} 次）"); return
     if await storage.has_active_break(chat.id, user.id, kind):
         await update.message.reply_text("已在取外卖中，先『回座』再开始"); return
     await storage.start_break(chat.id, user.id, kind, now_ts)
-    await update.message.reply_text(f"⏱️ 开始取外卖（≤{TAKEOUT_LIMIT_MIN} 分钟）")
-    context.job_queue.run_once(break_limit_job, when=datetime.now(timezone.utc) + timedelta(minutes=TAKEOUT_LIMIT_MIN),
+    await update.message.reply_text(f"⏱️ 开始取外卖（≤{limit_min} 分钟）")
+    context.job_queue.run_once(break_limit_job, when=datetime.now(timezone.utc) + timedelta(minutes=limit_min),
         chat_id=chat.id, name=f"limit-{kind}-{chat.id}-{user.id}",
-        data={"chat_id": chat.id, "user_id": user.id, "kind": kind, "limit_min": TAKEOUT_LIMIT_MIN})
+        data={"chat_id": chat.id, "user_id": user.id, "kind": kind, "limit_min": limit_min})
 
+@metrics.timed_handler("back_to_seat_cmd")
 async def back_to_seat_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat; user = update.effective_user
     now_ts = int(datetime.now(timezone.utc).timestamp())
@@ -496,16 +644,17 @@ async def back_to_seat_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _stop_break(update, context, k); return
     await update.message.reply_text("当前没有正在进行的休息")
 
+@metrics.timed_job("break_limit_job")
 async def break_limit_job(context: ContextTypes.DEFAULT_TYPE):
     d = context.job.data
     if await storage.has_active_break(d["chat_id"], d["user_id"], d["kind"]):
-        name_map = {"smoke": "吸烟", "toilet": "如厕", "takeout": "取外卖"}
-        kind_cn = name_map.get(d["kind"], d["kind"])
+        kind_cn = BREAK_NAMES.get(d["kind"], d["kind"])
         mention = f'<a href="tg://user?id={d["user_id"]}">请尽快回座</a>'
         await context.bot.send_message(
             chat_id=d["chat_id"],
             text=f"⏰ {kind_cn}已超过 {d['limit_min']} 分钟，{mention}。超时将记录处罚。",
             parse_mode="HTML",
+            rate_limit_args=SCHEDULED,
         )
 
 # ===== 关键词触发 =====
@@ -513,6 +662,7 @@ def _set_args(context, args_list):
     try: context.args = args_list
     except Exception: pass
 
+@metrics.timed_handler("keyword_handler")
 async def keyword_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text: return
     text_raw = update.message.text.strip()
@@ -545,52 +695,317 @@ async def keyword_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await start_cmd(update, context); return
 
 # ===== 按钮回调（打卡） =====
+@metrics.timed_handler("on_button")
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     chat = query.message.chat
-    lang = await get_lang(chat.id)
+    cfg = await settings.get(chat.id)
     await query.answer(cache_time=5)
     try:
-        await query.edit_message_text(t(lang, "checkin_ok", tz="ET"), reply_markup=kbd_checkin(lang))
+        await query.edit_message_text(t(cfg.lang, "checkin_ok", tz=cfg.tz_label), reply_markup=kbd_checkin(cfg.lang))
     except BadRequest as e:
         if "Message is not modified" not in str(e): raise
 
+# ===== 区间报表（/report，管理员）=====
+REPORT_MAX_DAYS = 366
+REPORT_CACHE_MAX = 64
+REPORT_USAGE = "用法：/report [today|week|YYYY-MM-DD [YYYY-MM-DD]]"
+
+# (chat_id, start_ts, end_ts, 数据版本) -> (消息段, CSV 字节或 None)；写入后版本变化，旧结果自然失效
+_report_cache: "OrderedDict[tuple, Tuple[List[str], Optional[bytes]]]" = OrderedDict()
+_report_inflight: Dict[tuple, asyncio.Task] = {}
+
+def _parse_report_range(cfg: settings.ChatSettings, args: List[str]):
+    """返回 (start_ts, end_ts, 标题)；参数不合法抛 ValueError"""
+    if not args or args[0] == "today":
+        start_ts, end_ts, start_local, end_local = cfg.today()
+    elif args[0] == "week":
+        start_ts, end_ts, start_local, end_local = cfg.this_week()
+    else:
+        if len(args) > 2:
+            raise ValueError(REPORT_USAGE)
+        try:
+            d1 = date.fromisoformat(args[0])
+            d2 = date.fromisoformat(args[1]) if len(args) == 2 else d1
+        except ValueError:
+            raise ValueError(REPORT_USAGE)
+        if d2 < d1:
+            raise ValueError("结束日期不能早于开始日期")
+        if (d2 - d1).days >= REPORT_MAX_DAYS:
+            raise ValueError(f"区间最长 {REPORT_MAX_DAYS} 天")
+        start_ts, _, start_local, _ = cfg.day_bounds_for(datetime(d1.year, d1.month, d1.day))
+        _, end_ts, _, end_local = cfg.day_bounds_for(datetime(d2.year, d2.month, d2.day))
+    title = f"📊 区间报表 {start_local:%Y-%m-%d} ~ {end_local:%Y-%m-%d}（{cfg.tz_label}）"
+    return start_ts, end_ts, title
+
+async def _build_range_report(chat_id: int, start_ts: int, end_ts: int, title: str) -> Tuple[List[str], Optional[bytes]]:
+    async with storage.report_snapshot() as db:
+        c, s_cnt, s_min, t_cnt, t_min, _ = await storage.summarize_between(chat_id, start_ts, end_ts, db)
+        total = await storage.count_daily_persons(chat_id, start_ts, end_ts, db)
+        head = [title, f"上班人数：{c}；吸烟 {s_cnt} 次 / {s_min} 分钟；如厕 {t_cnt} 次 / {t_min} 分钟"]
+        if not total:
+            return ["\n".join(head + ["", "（无数据）"])], None
+        rows = storage.iter_daily_person_summary(chat_id, start_ts, end_ts, db)
+        if total > REPORT_DOCUMENT_THRESHOLD:
+            f = await _report_csv(rows)
+            try:
+                data = f.read()
+            finally:
+                f.close()
+            return ["\n".join(head + [f"共 {total} 人，明细见附件"])], data
+        return [chunk async for chunk in render_report_chunks(head, rows)], None
+
+async def _range_key(chat_id: int, start_ts: int, end_ts: int):
+    """缓存键：区间 + 未结束记录的截止分钟（进行中的区间每分钟变一次）+ 数据版本（进程内写入 & 库内导入/恢复）"""
+    return (chat_id, start_ts, end_ts, storage.open_end(end_ts), *(await storage.data_generation(chat_id)))
+
+async def _range_report(chat_id: int, start_ts: int, end_ts: int, title: str):
+    """带缓存 + 同一区间并发请求合并"""
+    key = await _range_key(chat_id, start_ts, end_ts)
+    hit = _report_cache.get(key)
+    if hit is not None:
+        _report_cache.move_to_end(key)
+        return hit
+    task = _report_inflight.get(key)
+    if task is None:
+        task = _report_inflight[key] = asyncio.create_task(_build_range_report(chat_id, start_ts, end_ts, title))
+        task.add_done_callback(lambda _t: _report_inflight.pop(key, None))
+    result = await task
+    _report_cache[key] = result
+    while len(_report_cache) > REPORT_CACHE_MAX:
+        _report_cache.popitem(last=False)
+    return result
+
+async def _send_range_report(bot, chat_id: int, placeholder, result, start_ts: int):
+    chunks, doc = result
+    if placeholder is not None:
+        await bot.edit_message_text(chunks[0], chat_id=chat_id, message_id=placeholder.message_id,
+                                    rate_limit_args=SCHEDULED)
+    else:
+        await bot.send_message(chat_id, chunks[0], rate_limit_args=SCHEDULED)
+    for chunk in chunks[1:]:
+        await bot.send_message(chat_id, chunk, rate_limit_args=SCHEDULED)
+    if doc is not None:
+        await bot.send_document(chat_id, document=doc, filename=f"report-{start_ts}.csv", rate_limit_args=SCHEDULED)
+
+async def _finish_range_report(bot, chat_id: int, placeholder, start_ts: int, end_ts: int, title: str):
+    try:
+        result = await _range_report(chat_id, start_ts, end_ts, title)
+        await _send_range_report(bot, chat_id, placeholder, result, start_ts)
+    except Exception as e:
+        logging.error(f"range report failed: {e}", exc_info=e)
+        try:
+            await placeholder.edit_text("⚠️ 报表生成失败，请稍后重试")
+        except Exception:
+            pass
+
+@metrics.timed_handler("report_cmd")
+async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /report [today|week|开始日期 [结束日期]]
+    先回“生成中…”，统计在后台任务里跑，完成后编辑这条消息；同一区间且数据没变时直接命中缓存。
+    """
+    chat = update.effective_chat
+    if not await _is_chat_admin(update, context):
+        await update.message.reply_text("⚠️ 仅群管理员可以查看区间报表"); return
+    cfg = await settings.get(chat.id)
+    try:
+        start_ts, end_ts, title = _parse_report_range(cfg, context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(str(e)); return
+
+    key = await _range_key(chat.id, start_ts, end_ts)
+    if key in _report_cache:
+        await _send_range_report(context.bot, chat.id, None, await _range_report(chat.id, start_ts, end_ts, title), start_ts)
+        return
+    placeholder = await update.message.reply_text(f"{title}\n⏳ 生成中…")
+    context.application.create_task(
+        _finish_range_report(context.bot, chat.id, placeholder, start_ts, end_ts, title), update=update)
+
+# ===== 群配置（管理员）=====
+_WEEKDAYS_CN = "一二三四五六日"
+
+async def _is_chat_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    chat = update.effective_chat
+    if chat.type == "private":
+        return True
+    try:
+        member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
+    except Exception as e:
+        logging.warning(f"get_chat_member failed: {e}")
+        return False
+    return is_admin_status(member)
+
+def _settings_text(cfg: settings.ChatSettings) -> str:
+    sched = "；".join(
+        f"周{_WEEKDAYS_CN[wd]} {sh:02d}:{sm:02d}-{eh:02d}:{em:02d}"
+        for wd, (sh, sm, eh, em) in sorted(cfg.schedule.items()) if cfg.is_workday(wd)
+    ) or "（无）"
+    limits = "；".join(f"{BREAK_NAMES.get(k, k)} ≤{m} 分钟 × {n} 次/天" for k, (m, n) in cfg.limits.items())
+    return (
+        f"⚙️ 本群配置\n"
+        f"• 时区：{cfg.tz_name}\n"
+        f"• 语言：{cfg.lang}\n"
+        f"• 工作日程：{sched}\n"
+        f"• 休息限制：{limits}"
+    )
+
+def _nargs(args, n: int):
+    if len(args) != n:
+        raise ValueError("")
+    return args
+
+_SETTING_CMDS = {
+    # 命令: (用法, 参数 -> settings.update 的字段)
+    "settz":       ("/settz America/New_York", lambda a: {"tz": settings.parse_tz(_nargs(a, 1)[0])}),
+    "setlang":     ("/setlang zh|en|vi", lambda a: {"lang": settings.parse_lang(_nargs(a, 1)[0])}),
+    "setlimit":    ("/setlimit smoke|toilet|takeout 分钟 每日次数",
+                    lambda a: {"limits": dict([settings.parse_limit(*_nargs(a, 3))])}),
+    "setschedule": ("/setschedule 0-4 09:00-22:00（0=周一；时间可写 off）",
+                    lambda a: {"schedule": settings.parse_schedule(*_nargs(a, 2))}),
+}
+
+@metrics.timed_handler("settings_cmd")
+async def settings_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(_settings_text(await settings.get(update.effective_chat.id)))
+
+@metrics.timed_handler("set_setting_cmd")
+async def set_setting_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE, cmd: str):
+    usage, parse = _SETTING_CMDS[cmd]
+    if not await _is_chat_admin(update, context):
+        await update.message.reply_text("⚠️ 仅群管理员可以修改本群配置"); return
+    try:
+        fields = parse(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\n用法：{usage}" if str(e) else f"用法：{usage}"); return
+
+    chat_id = update.effective_chat.id
+    cfg = await settings.update(chat_id, **fields)  # 写库 + 失效缓存
+    # 已开启定时任务的群按新时区/日程重排
+    if context.job_queue.get_jobs_by_name(f"greet-{chat_id}-daily"):
+        await schedule_chat_jobs(context.application, chat_id)
+    await update.message.reply_text("✅ 已更新\n" + _settings_text(cfg))
+
 # ===== FastAPI webhook =====
 app_fastapi = FastAPI()
 bot_app = None
+_app_ready = asyncio.Event()
 
 @app_fastapi.get("/healthz")
 async def healthz(): return PlainTextResponse("ok")
 
 @app_fastapi.post(f"/webhook/{WEBHOOK_SECRET}")
 async def webhook(request: Request):
+    if bot_app is None or not bot_app.running:
+        # 端口先于 Bot 初始化开放；这段时间到达的 update 稍等，超时返回 503 让 Telegram 重投
+        try:
+            await asyncio.wait_for(_app_ready.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            return PlainTextResponse("starting", status_code=503)
     data = await request.json()
     update = Update.de_json(data, bot_app.bot)
-    await bot_app.process_update(update)
+    metrics.WEBHOOK_INFLIGHT.inc()
+    try:
+        await bot_app.process_update(update)
+    finally:
+        metrics.WEBHOOK_INFLIGHT.dec()
     return PlainTextResponse("ok")
 
+@app_fastapi.get("/metrics")
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        return PlainTextResponse("metrics disabled", status_code=404)
+    metrics.OPEN_BREAKS.set(await storage.count_open_breaks())
+    if bot_app is not None:
+        metrics.UPDATE_QUEUE.set(bot_app.update_queue.qsize())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app_fastapi.get("/org/rollup")
+async def org_rollup_endpoint(period: str = "day", day: Optional[str] = None, top: int = ORG_TOP_N,
+                              x_admin_token: Optional[str] = Header(None)):
+    """组织汇总 JSON；period=day|week，day=YYYY-MM-DD（默认今天，美东）"""
+    if not profiling.check_admin(x_admin_token):
+        return PlainTextResponse("not found", status_code=404)
+    if period not in ("day", "week"):
+        return PlainTextResponse("period must be day or week", status_code=400)
+    try:
+        ref = date.fromisoformat(day) if day else None
+    except ValueError:
+        return PlainTextResponse("day must be YYYY-MM-DD", status_code=400)
+    start_ts, end_ts, start_local, end_local = _org_bounds(period, ref)
+    t0 = time.perf_counter()
+    r = await storage.org_rollup(start_ts, end_ts, max(0, min(top, 100)))
+    r.update(period=period, start=start_local.isoformat(), end=end_local.isoformat(),
+             elapsed_ms=round((time.perf_counter() - t0) * 1000, 1))
+    return JSONResponse(r)
+
+# ===== 调试（需 ADMIN_TOKEN，未配置时一律 404）=====
+_PROFILE_SORTS = {"cumulative", "tottime", "calls"}
+
+def _profile_args_error(sort: str) -> Optional[PlainTextResponse]:
+    if sort not in _PROFILE_SORTS:
+        return PlainTextResponse(f"sort must be one of {sorted(_PROFILE_SORTS)}", status_code=400)
+    return None
+
+@app_fastapi.post("/debug/profile")
+async def debug_profile(seconds: float = 30, sort: str = "cumulative", limit: int = 60,
+                        x_admin_token: Optional[str] = Header(None)):
+    """采样 N 秒后直接返回 pstats 文本"""
+    if not profiling.check_admin(x_admin_token):
+        return PlainTextResponse("not found", status_code=404)
+    err = _profile_args_error(sort)
+    if err: return err
+    text = await profiling.session.run_for(seconds, sort, limit)
+    if text is None:
+        return PlainTextResponse("profile already running", status_code=409)
+    return PlainTextResponse(text)
+
+@app_fastapi.post("/debug/profile/start")
+async def debug_profile_start(x_admin_token: Optional[str] = Header(None)):
+    if not profiling.check_admin(x_admin_token):
+        return PlainTextResponse("not found", status_code=404)
+    if not profiling.session.start():
+        return PlainTextResponse("profile already running", status_code=409)
+    return PlainTextResponse("started")
+
+@app_fastapi.post("/debug/profile/stop")
+async def debug_profile_stop(sort: str = "cumulative", limit: int = 60,
+                             x_admin_token: Optional[str] = Header(None)):
+    if not profiling.check_admin(x_admin_token):
+        return PlainTextResponse("not found", status_code=404)
+    err = _profile_args_error(sort)
+    if err: return err
+    text = profiling.session.stop(sort, limit)
+    if text is None:
+        return PlainTextResponse("no profile running", status_code=409)
+    return PlainTextResponse(text)
+
 # ===== 错误处理器 =====
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logging.error("Update caused error", exc_info=context.error)
 
 # ===== 启动 =====
-async def main_async():
-    global bot_app
-    app = Application.builder().token(BOT_TOKEN).rate_limiter(AIORateLimiter()).build()
-    bot_app = app
-
-    await app.initialize()
-    # 斜杠菜单
-    await app.bot.set_my_commands([
-        ("workin", "上班打卡"),
-        ("workout", "下班打卡"),
-        ("smoke_start", "抽烟"),
-        ("smoke_stop", "结束吸烟"),
-        ("toilet_start", "上厕所"),
-        ("toilet_stop", "拉完了"),
-        ("takeout", "取外卖"),
-        ("back_to_seat", "回座"),
-    ])
+BOT_COMMANDS = [
+    ("workin", "上班打卡"),
+    ("workout", "下班打卡"),
+    ("smoke_start", "抽烟"),
+    ("smoke_stop", "结束吸烟"),
+    ("toilet_start", "上厕所"),
+    ("toilet_stop", "拉完了"),
+    ("takeout", "取外卖"),
+    ("back_to_seat", "回座"),
+    ("settings", "本群配置"),
+    ("report", "区间报表"),
+]
+
+def build_application() -> Application:
+    # 所有外发共用 bot 的一个 HTTP 连接池；并发由 PriorityRateLimiter 的令牌控制
+    builder = (Application.builder().token(BOT_TOKEN)
+               .rate_limiter(outbound.PriorityRateLimiter())
+               .connection_pool_size(OUTBOUND_POOL_SIZE).pool_timeout(10.0))
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    app = builder.build()
 
     # handlers
     app.add_handler(CommandHandler("start", start_cmd))
@@ -602,21 +1017,144 @@ async def main_async():
     app.add_handler(CommandHandler("toilet_stop",  lambda u,c: _stop_break(u,c,"toilet")))
     app.add_handler(CommandHandler("takeout", _start_takeout))
     app.add_handler(CommandHandler("back_to_seat", back_to_seat_cmd))
+    app.add_handler(CommandHandler("settings", settings_cmd))
+    app.add_handler(CommandHandler("report", report_cmd))
+    for cmd in _SETTING_CMDS:
+        app.add_handler(CommandHandler(cmd, lambda u,c,cmd=cmd: set_setting_cmd(u,c,cmd)))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, keyword_handler))
     app.add_handler(CallbackQueryHandler(on_button))
     app.add_error_handler(error_handler)
+    return app
 
-    if ENABLE_POLLING:
-        await app.start(); await _reschedule_active_breaks(app); await app.updater.start_polling(); await app.updater.idle()
+# ===== 启动 =====
+BOT_SETUP_META_KEY = "bot_setup_hash"
+FORCE_BOT_SETUP = os.getenv("FORCE_BOT_SETUP", "false").lower() == "true"
+
+def _bot_setup_hash(webhook_url: Optional[str]) -> str:
+    """菜单 + webhook 地址（+ bot id）的指纹；换 token / 改菜单 / 改地址都会变"""
+    blob = json.dumps([BOT_TOKEN.split(":")[0] if BOT_TOKEN else None, BOT_COMMANDS, webhook_url], ensure_ascii=False)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+async def _sync_bot_setup(app: Application, webhook_url: Optional[str]) -> bool:
+    """
+    菜单/webhook 与上次开机相同时跳过设置；返回是否实际调用了。
+    指纹相同也要用 getWebhookInfo 核对一次：webhook 可能在 Telegram 那边被删/被改（别的实例、手动 deleteWebhook）。
+    """
+    digest = _bot_setup_hash(webhook_url)
+    if not FORCE_BOT_SETUP and await storage.get_meta(BOT_SETUP_META_KEY) == digest:
+        if (await app.bot.get_webhook_info()).url == (webhook_url or ""):
+            return False
+        log.warning("webhook on Telegram differs from last setup, re-registering")
+    await app.bot.set_my_commands(BOT_COMMANDS)
+    if webhook_url:
+        await app.bot.set_webhook(url=webhook_url)
     else:
-        await app.bot.set_webhook(url=f"{BASE_URL}/webhook/{WEBHOOK_SECRET}")
+        await app.bot.delete_webhook()  # 有 webhook 时 getUpdates 会 409
+    await storage.set_meta(BOT_SETUP_META_KEY, digest)
+    return True
+
+class _StartupTimer:
+    """分阶段记录冷启动耗时：import / db / serve / telegram，另外在后台记录 warmup"""
+
+    def __init__(self):
+        self.t = time.perf_counter()
+        self.phases: Dict[str, float] = {"import": (self.t - _BOOT_T0) * 1000}
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = (now - self.t) * 1000
+        self.t = now
+        metrics.gauge("bot_startup_phase_ms", "冷启动各阶段耗时", phase=phase).set(self.phases[phase])
+
+    def report(self, what: str):
+        detail = " ".join(f"{k}={v:.0f}ms" for k, v in self.phases.items())
+        log.info(f"{what} in {(time.perf_counter() - _BOOT_T0) * 1000:.0f}ms ({detail})")
+
+async def _warmup(app: Application, timer: _StartupTimer):
+    """开始服务之后再做：预热群配置缓存 + 恢复进行中的休息提醒 + 排定时任务；各步独立，一步失败不影响其他步"""
+    t0 = time.perf_counter()
+    failed = []
+
+    async def step(name, fn):
+        try:
+            r = fn()
+            return (await r) if asyncio.iscoroutine(r) else r
+        except Exception as e:
+            failed.append(name)
+            logging.error(f"warmup step {name} failed: {e}", exc_info=e)
+
+    n = await step("settings", settings.warm) or 0
+    await step("breaks", lambda: _reschedule_active_breaks(app))
+    await step("backup", lambda: schedule_backup(app))
+    await step("org_rollup", lambda: schedule_org_rollup(app))
+    timer.mark("warmup")
+    log.info(f"warmup: {n} chat settings cached, breaks recovered in {(time.perf_counter() - t0) * 1000:.0f}ms"
+             + (f"; failed: {', '.join(failed)}" if failed else ""))
+
+async def _wait_server_started(server: uvicorn.Server, task: asyncio.Task):
+    while not server.started:
+        if task.done():
+            task.result()  # 绑定端口失败等，直接抛出
+            raise RuntimeError("uvicorn exited before startup")
+        await asyncio.sleep(0.01)
+
+async def main_async():
+    global bot_app
+    timer = _StartupTimer()
+    app = build_application()
+    bot_app = app
+    profiling.install_loop_watchdog()
+
+    await ensure_db()
+    timer.mark("db")
+
+    if shard.SHARD_INDEX is not None:
+        # 分片 worker：菜单/webhook 由 front 负责，这里只处理转发来的 update
+        await app.initialize(); await app.start()
+        timer.mark("telegram")
+        timer.report("shard worker ready")
+        app.create_task(_warmup(app, timer))
+        await shard.serve_worker(app, shard.SHARD_INDEX)
+        return
+
+    if ENABLE_POLLING:
+        await app.initialize()
+        await _sync_bot_setup(app, None)
         await app.start()
-        await _reschedule_active_breaks(app)
-        server = uvicorn.Server(uvicorn.Config(app_fastapi, host="0.0.0.0", port=PORT))
-        await server.serve()
+        timer.mark("telegram")
+        timer.mark("serve")  # 轮询没有端口可开，紧接着就开始 getUpdates
+        timer.report("polling ready")
+        app.create_task(_warmup(app, timer))
+        try:
+            await polling.run_until_signal(app)
+        finally:
+            await app.stop(); await app.shutdown()
+        return
+
+    # webhook：先开端口（/healthz 立即可用），再初始化 Bot，最后后台恢复定时器
+    server = uvicorn.Server(uvicorn.Config(app_fastapi, host="0.0.0.0", port=PORT))
+    serve_task = asyncio.create_task(server.serve())
+    await _wait_server_started(server, serve_task)
+    timer.mark("serve")
+    try:
+        await app.initialize()
+        changed = await _sync_bot_setup(app, f"{BASE_URL}/webhook/{WEBHOOK_SECRET}")
+        await app.start()
+        _app_ready.set()
+        timer.mark("telegram")
+        timer.report(f"webhook ready (bot setup {'updated' if changed else 'unchanged, skipped'})")
+        app.create_task(_warmup(app, timer))
+        await serve_task
+    finally:
+        if app.running:
+            await app.stop()
+        await app.shutdown()
 
 def main():
-    asyncio.run(main_async())
+    if shard.SHARD_COUNT > 1 and shard.SHARD_INDEX is None:
+        asyncio.run(shard.run_front(BOT_TOKEN, BOT_COMMANDS, BASE_URL, WEBHOOK_SECRET, PORT))
+    else:
+        asyncio.run(main_async())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,146 @@
+# app/metrics.py
+"""
+极简 Prometheus 指标（/metrics 文本格式，不依赖 prometheus_client）。
+
+- 所有观测都发生在事件循环线程里，直接改属性即可，不加锁
+- 子指标（带标签）在装饰/首次使用时创建并缓存，热路径上只做加法和一次 bisect
+- METRICS_ENABLED=false 时装饰器原样返回函数，完全零开销
+"""
+import functools, os, time
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# 毫秒
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class Counter:
+    __slots__ = ("value",)
+    def __init__(self): self.value = 0
+    def inc(self, n: float = 1): self.value += n
+
+class Gauge:
+    __slots__ = ("value",)
+    def __init__(self): self.value = 0
+    def set(self, v: float): self.value = v
+    def inc(self, n: float = 1): self.value += n
+    def dec(self, n: float = 1): self.value -= n
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # 最后一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+    def observe(self, v: float):
+        self.counts[bisect_left(BUCKETS_MS, v)] += 1
+        self.sum += v
+        self.count += 1
+
+class _Family:
+    __slots__ = ("help", "kind", "children")
+    def __init__(self, help: str, kind: str):
+        self.help, self.kind = help, kind
+        self.children: Dict[Tuple[Tuple[str, str], ...], object] = {}
+
+_families: Dict[str, _Family] = {}
+_KINDS = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+def _child(cls, name: str, help: str, labels: Dict[str, str]):
+    fam = _families.get(name)
+    if fam is None:
+        fam = _families[name] = _Family(help, _KINDS[cls])
+    key = tuple(sorted(labels.items()))
+    ch = fam.children.get(key)
+    if ch is None:
+        ch = fam.children[key] = cls()
+    return ch
+
+def counter(name: str, help: str = "", **labels) -> Counter: return _child(Counter, name, help, labels)
+def gauge(name: str, help: str = "", **labels) -> Gauge: return _child(Gauge, name, help, labels)
+def histogram(name: str, help: str = "", **labels) -> Histogram: return _child(Histogram, name, help, labels)
+
+# ===== 常用指标 =====
+WEBHOOK_INFLIGHT = gauge("bot_webhook_inflight", "正在处理的 webhook 请求数")
+UPDATE_QUEUE = gauge("bot_update_queue_depth", "Application.update_queue 积压")
+OPEN_BREAKS = gauge("bot_open_breaks", "进行中的休息数")
+
+# ===== 装饰器 =====
+def _timed(h: Histogram, rows: Optional[Counter] = None):
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                res = await fn(*args, **kwargs)
+            finally:
+                h.observe((time.perf_counter() - t0) * 1000)
+            if rows is not None and isinstance(res, list):  # 只数真正的行列表；标量/布尔/汇总元组不算行
+                rows.inc(len(res))
+            return res
+        return wrapper
+    return deco
+
+def timed_handler(name: str):
+    return _timed(histogram("bot_handler_latency_ms", "处理器耗时", handler=name))
+
+def timed_sql(name: str):
+    return _timed(histogram("bot_sql_latency_ms", "存储函数耗时", fn=name),
+                  counter("bot_sql_rows_total", "存储函数返回行数", fn=name))
+
+def _planned_ts(job) -> Optional[float]:
+    """由 APScheduler 触发器反推本次计划触发时间"""
+    trig = getattr(getattr(job, "job", None), "trigger", None)
+    interval = getattr(trig, "interval", None)
+    if interval is not None:  # IntervalTrigger（run_repeating）
+        start, iv = trig.start_date.timestamp(), interval.total_seconds()
+        now = time.time()
+        return now - ((now - start) % iv)
+    run_date = getattr(trig, "run_date", None)  # DateTrigger（run_once）
+    return run_date.timestamp() if run_date else None
+
+def timed_job(name: str):
+    """定时任务：记录 实际触发 - 计划触发 的延迟 + 任务耗时"""
+    lag = histogram("bot_job_lag_ms", "定时任务触发延迟", job=name)
+    run = _timed(histogram("bot_job_latency_ms", "定时任务耗时", job=name))
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        timed_fn = run(fn)
+        @functools.wraps(fn)
+        async def wrapper(context):
+            planned = _planned_ts(context.job)
+            if planned is not None:
+                lag.observe(max(0.0, time.time() - planned) * 1000)
+            return await timed_fn(context)
+        return wrapper
+    return deco
+
+# ===== 导出 =====
+def _fmt_labels(key, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render() -> str:
+    out = []
+    for name, fam in _families.items():
+        out.append(f"# HELP {name} {fam.help}")
+        out.append(f"# TYPE {name} {fam.kind}")
+        for key, ch in fam.children.items():
+            if fam.kind != "histogram":
+                out.append(f"{name}{_fmt_labels(key)} {ch.value}")
+                continue
+            acc = 0
+            for le, n in zip(BUCKETS_MS, ch.counts):
+                acc += n
+                le_label = f'le="{le}"'
+                out.append(f"{name}_bucket{_fmt_labels(key, le_label)} {acc}")
+            inf_label = 'le="+Inf"'
+            out.append(f"{name}_bucket{_fmt_labels(key, inf_label)} {ch.count}")
+            out.append(f"{name}_sum{_fmt_labels(key)} {ch.sum}")
+            out.append(f"{name}_count{_fmt_labels(key)} {ch.count}")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,228 @@
+# app/outbound.py
+"""
+外发 Bot API 调度：替代 AIORateLimiter，按优先级分道 + 按群令牌桶。
+
+- 三条道：INTERACTIVE（打卡/休息的即时回复，默认）> SCHEDULED（超时提醒、区间报表）> BULK（问好/提醒/快照/日报）
+  调用时用 rate_limit_args 指定，例如 bot.send_message(..., rate_limit_args=outbound.BULK)
+- 全局桶：30 次/秒（Telegram 对单个 bot 的总限制）
+- 群桶：群 20 条/分钟，私聊 1 条/秒（只对发/改消息类方法生效）
+- 429 RetryAfter 只冻结对应的群（没有 chat_id 时才冻结全局），其他群照常发送
+- 每条道记录排队等待时间（/metrics）
+"""
+import asyncio, heapq, itertools, logging, time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from . import metrics
+
+log = logging.getLogger("pro-bot.outbound")
+
+INTERACTIVE, SCHEDULED, BULK = 0, 1, 2
+LANE_NAMES = {INTERACTIVE: "interactive", SCHEDULED: "scheduled", BULK: "bulk"}
+
+GLOBAL_RATE, GLOBAL_BURST = 30.0, 30
+GROUP_RATE, GROUP_BURST = 20 / 60, 20
+PRIVATE_RATE, PRIVATE_BURST = 1.0, 3
+
+# 受群限速的方法（发/改消息类）
+_CHAT_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate, self.capacity = rate, capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """距离下一个可用令牌还要等多久（秒）"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+class _ChatQueue:
+    __slots__ = ("bucket", "pending", "sleeping")
+
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.bucket = bucket
+        self.pending: List[Tuple[int, int, asyncio.Future]] = []  # 堆：(lane, seq, fut)
+        self.sleeping = False
+
+def _chat_key(endpoint: str, data: Dict[str, Any]) -> Union[int, str, None]:
+    if not endpoint.lower().startswith(_CHAT_LIMITED_PREFIXES):
+        return None
+    return data.get("chat_id")
+
+def _bucket_for(key: Union[int, str, None]) -> Optional[TokenBucket]:
+    if key is None:
+        return None
+    is_group = isinstance(key, str) or int(key) < 0  # @channel 用户名 / 负数 id 都按群算
+    return TokenBucket(GROUP_RATE, GROUP_BURST) if is_group else TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    调度器只在一个后台协程里分发令牌：
+    _ready  —— 可立即发送的群的队首 (lane, seq, key)，按优先级出堆（过期项惰性丢弃）
+    _asleep —— 令牌不足/被 429 冻结的群 (醒来时间, key)
+    """
+
+    def __init__(self, max_retries: int = 3):
+        self._max_retries = max_retries
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats: Dict[Any, _ChatQueue] = {}
+        self._ready: List[Tuple[int, int, Any]] = []
+        self._asleep: List[Tuple[float, Any]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._wait_ms = {lane: metrics.histogram("bot_outbound_queue_wait_ms", "外发排队等待", lane=name)
+                         for lane, name in LANE_NAMES.items()}
+        self._depth = {lane: metrics.gauge("bot_outbound_queue_depth", "外发排队数", lane=name)
+                       for lane, name in LANE_NAMES.items()}
+        self._retry = metrics.counter("bot_telegram_retry_after_total", "Telegram 429 次数")
+        self._latency: Dict[str, metrics.Histogram] = {}
+
+    async def initialize(self) -> None:
+        # Application 和 Updater 各会调一次 bot.initialize()，第二次直接返回，不另起一个调度协程
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._start()
+
+    async def shutdown(self) -> None:
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def _start(self):
+        self._task = asyncio.create_task(self._dispatch_loop())
+        self._task.add_done_callback(self._on_dispatch_done)
+
+    def _on_dispatch_done(self, task: asyncio.Task):
+        """调度协程意外退出：排队中的请求全部报错（不让调用方永远挂着），清空状态后重启"""
+        if task is not self._task or task.cancelled():
+            return
+        exc = task.exception() or RuntimeError("outbound dispatcher exited")
+        log.error("outbound dispatcher died, failing pending requests and restarting", exc_info=exc)
+        for q in self._chats.values():
+            for _, _, fut in q.pending:
+                if not fut.done():
+                    fut.set_exception(exc)
+        self._chats.clear(); self._ready.clear(); self._asleep.clear()
+        self._start()
+
+    # ----- 排队 -----
+    async def _acquire(self, lane: int, key: Any, seq: int):
+        """seq 由调用方分配，429 重试沿用原值，不会排到同道后来的请求后面"""
+        fut = asyncio.get_running_loop().create_future()
+        q = self._chats.get(key)
+        if q is None:
+            q = self._chats[key] = _ChatQueue(_bucket_for(key))
+        heapq.heappush(q.pending, (lane, seq, fut))
+        if not q.sleeping and q.pending[0][1] == seq:  # 成为新的队首
+            heapq.heappush(self._ready, (lane, seq, key))
+        self._depth[lane].inc()
+        self._wakeup.set()
+        try:
+            await fut
+        finally:
+            self._depth[lane].dec()
+
+    def _push_head(self, key: Any, q: _ChatQueue):
+        while q.pending and q.pending[0][2].done():  # 调用方已取消
+            heapq.heappop(q.pending)
+        if q.pending:
+            lane, seq, _ = q.pending[0]
+            heapq.heappush(self._ready, (lane, seq, key))
+
+    async def _sleep(self, seconds: float):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch_loop(self):
+        while True:
+            now = time.monotonic()
+            while self._asleep and self._asleep[0][0] <= now:
+                _, key = heapq.heappop(self._asleep)
+                q = self._chats[key]
+                q.sleeping = False
+                self._push_head(key, q)
+
+            if not self._ready:
+                await self._sleep(self._asleep[0][0] - now if self._asleep else None)
+                continue
+            gdelay = self._global.delay(now)
+            if gdelay > 0:
+                await asyncio.sleep(gdelay)
+                continue
+
+            lane, seq, key = heapq.heappop(self._ready)
+            q = self._chats[key]
+            if not q.pending or q.pending[0][1] != seq:
+                continue  # 过期项：队首已变（有更高优先级插队或已被取消）
+            cdelay = q.bucket.delay(now) if q.bucket else 0.0
+            if cdelay > 0:
+                q.sleeping = True
+                heapq.heappush(self._asleep, (now + cdelay, key))
+                continue
+
+            _, _, fut = heapq.heappop(q.pending)
+            if not fut.done():
+                self._global.take()
+                if q.bucket: q.bucket.take()
+                fut.set_result(None)
+            self._push_head(key, q)
+
+    # ----- BaseRateLimiter -----
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]], None]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]], None]:
+        lane = rate_limit_args if rate_limit_args in LANE_NAMES else INTERACTIVE
+        key = _chat_key(endpoint, data)
+        latency = self._latency.get(endpoint)
+        if latency is None:
+            latency = self._latency[endpoint] = metrics.histogram(
+                "bot_telegram_api_latency_ms", "Bot API 调用耗时", endpoint=endpoint)
+
+        seq = next(self._seq)
+        for attempt in range(self._max_retries + 1):
+            t0 = time.perf_counter()
+            await self._acquire(lane, key, seq)
+            t1 = time.perf_counter()
+            self._wait_ms[lane].observe((t1 - t0) * 1000)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._retry.inc()
+                if attempt >= self._max_retries:
+                    raise
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                log.warning(f"429 on {endpoint} chat={key}: retry after {delay}s ({LANE_NAMES[lane]})")
+                # 只冻结出问题的群；没有群信息才冻结全局
+                (self._chats[key].bucket or self._global).block(time.monotonic() + delay)
+            finally:
+                latency.observe((time.perf_counter() - t1) * 1000)
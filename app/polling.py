@@ -0,0 +1,184 @@
+# app/polling.py
+"""
+自建 getUpdates 轮询（ENABLE_POLLING=true），替代 PTB 默认的逐条处理：
+
+- 长轮询：timeout=POLL_TIMEOUT 秒，每批最多 POLL_LIMIT 条（Telegram 上限 100）
+- 拉到的 update 按群放进各自的队列就继续拉下一批：同一群按 update_id 顺序串行，不同群并发
+  （最多 POLL_CONCURRENCY 条同时处理），一个慢群不会挡住其他群
+- offset 只前移到“最小的未处理完的 update_id”：下次 getUpdates 才确认，进程中途退出时没处理完的会被 Telegram 重投；
+  重投回来的、已在处理中的 update 按 id 跳过。因此处理中的 update 最多 POLL_LIMIT 条（天然背压），
+  一批全是处理中的就等有 update 处理完再拉
+- 处理器抛异常（error_handler 之外的）只记日志，该 update 视为已处理、不重试（避免毒消息卡住 offset）
+- SIGINT/SIGTERM：停止拉取，处理完已收到的 update，提交 offset 后退出
+"""
+import asyncio, logging, os, signal
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.error import Conflict, NetworkError, RetryAfter, TimedOut
+
+from . import metrics
+
+log = logging.getLogger("pro-bot.polling")
+
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "50"))        # 长轮询秒数
+POLL_LIMIT = min(100, int(os.getenv("POLL_LIMIT", "100")))  # 每批条数
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "64")) # 同时处理的 update 数
+_BACKOFF_MAX = 30.0
+
+class ChatDispatcher:
+    """
+    按群排队处理 update：同一群按放入顺序串行，不同群并发（最多 concurrency 条同时处理）。
+    每条处理完（含抛异常）调用放入时给的 on_done(update_id)。Poller 和分片 worker 共用。
+    """
+
+    def __init__(self, app, concurrency: int = POLL_CONCURRENCY):
+        self.app = app
+        self._chats: Dict[object, Deque[Tuple[Update, Callable[[int], None]]]] = {}
+        self._workers: Set[asyncio.Task] = set()
+        self._sem = asyncio.Semaphore(concurrency)
+
+    def put(self, u: Update, on_done: Callable[[int], None]):
+        chat = u.effective_chat
+        key = chat.id if chat else ("u", u.update_id)
+        q = self._chats.get(key)
+        if q is None:
+            q = self._chats[key] = deque()
+            task = asyncio.create_task(self._chat_worker(key, q))
+            self._workers.add(task)
+            task.add_done_callback(self._workers.discard)
+        q.append((u, on_done))
+
+    async def _chat_worker(self, key, q: Deque[Tuple[Update, Callable[[int], None]]]):
+        """同一群串行；队列空了就退出，下次有新 update 再起"""
+        try:
+            while q:
+                u, on_done = q[0]
+                async with self._sem:
+                    try:
+                        await self.app.process_update(u)  # 处理器异常已由 error_handler 兜底
+                    except Exception as e:
+                        log.error(f"update {u.update_id} failed, dropped: {e}", exc_info=e)
+                q.popleft()
+                on_done(u.update_id)
+        finally:
+            del self._chats[key]
+
+    async def drain(self):
+        """等已放入的 update 全部处理完"""
+        while self._workers:
+            await asyncio.gather(*list(self._workers), return_exceptions=True)
+
+class Poller:
+    def __init__(self, app, timeout: int = POLL_TIMEOUT, limit: int = POLL_LIMIT, concurrency: int = POLL_CONCURRENCY):
+        self.app = app
+        self.timeout, self.limit = timeout, limit
+        self.offset: Optional[int] = None  # 下一次要确认到的 update_id（= 最小的未处理完的 id）
+        self._seen: Optional[int] = None   # 已分派的最大 id
+        self._pending: "OrderedDict[int, bool]" = OrderedDict()  # 已分派的 id（升序）-> 是否处理完
+        self._dispatcher = ChatDispatcher(app, concurrency)
+        self._progress = asyncio.Event()
+        self._updates = metrics.counter("bot_polling_updates_total", "轮询收到的 update 数")
+        self._errors = metrics.counter("bot_polling_errors_total", "getUpdates 失败次数")
+        self._inflight = metrics.gauge("bot_polling_inflight", "已收到、未处理完的 update 数")
+
+    async def _fetch(self) -> List[Update]:
+        return await self.app.bot.get_updates(
+            offset=self.offset, limit=self.limit, timeout=self.timeout,
+            read_timeout=self.timeout + 10, allowed_updates=Update.ALL_TYPES,
+        )
+
+    # ----- 分派 / 完成 -----
+    def dispatch(self, batch: List[Update]) -> int:
+        """放进各群队列（不等待处理），返回新分派的条数；已在处理中的重投按 id 跳过"""
+        n = 0
+        for u in batch:
+            if self._seen is not None and u.update_id <= self._seen:
+                continue
+            self._seen = u.update_id
+            self._pending[u.update_id] = False
+            self._dispatcher.put(u, self._done)
+            n += 1
+        if self.offset is None and self._pending:
+            self.offset = next(iter(self._pending))
+        self._updates.inc(n)
+        self._inflight.set(len(self._pending))
+        return n
+
+    def _done(self, update_id: int):
+        self._pending[update_id] = True
+        while self._pending and next(iter(self._pending.values())):
+            self._pending.popitem(last=False)
+        self.offset = next(iter(self._pending)) if self._pending else self._seen + 1
+        self._inflight.set(len(self._pending))
+        if len(self._pending) < self.limit:  # 窗口（offset 起的 limit 条）有空位，再拉才可能拿到新的
+            self._progress.set()
+
+    async def drain(self):
+        """等已分派的 update 全部处理完"""
+        await self._dispatcher.drain()
+
+    # ----- 主循环 -----
+    async def run(self, stop: asyncio.Event):
+        backoff = 1.0
+        stop_wait = asyncio.ensure_future(stop.wait())
+        try:
+            while not stop.is_set():
+                self._progress.clear()  # 拉取期间有 update 处理完也算进度
+                fetch = asyncio.ensure_future(self._fetch())
+                await asyncio.wait({fetch, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not fetch.done():
+                    fetch.cancel()  # 本次拉到的还没确认，Telegram 下次会重投
+                    break
+                try:
+                    batch = fetch.result()
+                except RetryAfter as e:
+                    await self._pause(stop, e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after))
+                    continue
+                except (TimedOut, NetworkError, Conflict) as e:
+                    # Conflict：另有实例在轮询 / webhook 未删除
+                    self._errors.inc()
+                    log.warning(f"getUpdates failed: {e}; retry in {backoff:.0f}s")
+                    await self._pause(stop, backoff)
+                    backoff = min(backoff * 2, _BACKOFF_MAX)
+                    continue
+                backoff = 1.0
+                if batch and not self.dispatch(batch):
+                    # 拉回来的全是处理中的（offset 卡在某个慢群上）：等有 update 处理完再拉
+                    progress = asyncio.ensure_future(self._progress.wait())
+                    await asyncio.wait({progress, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+                    progress.cancel()
+        finally:
+            stop_wait.cancel()
+            await self.drain()  # 收到停止信号也先把已收到的处理完
+            await self._commit()
+
+    async def _pause(self, stop: asyncio.Event, seconds: float):
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _commit(self):
+        """退出前把 offset 告诉 Telegram，避免重启后重复处理最后一批"""
+        if self.offset is None:
+            return
+        try:
+            await self.app.bot.get_updates(offset=self.offset, limit=1, timeout=0)
+        except Exception as e:
+            log.warning(f"offset commit failed (last batch may be redelivered): {e}")
+
+async def run_until_signal(app):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    poller = Poller(app)
+    log.info(f"polling: timeout={poller.timeout}s limit={poller.limit} concurrency={POLL_CONCURRENCY}")
+    try:
+        await poller.run(stop)
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+    log.info(f"polling stopped at offset {poller.offset}")
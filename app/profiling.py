@@ -0,0 +1,109 @@
+# app/profiling.py
+"""
+线上排查工具（默认全部关闭）：
+
+- cProfile 会话：管理员通过 /debug/profile 开启 N 秒，返回 pstats 文本
+- 事件循环卡顿看门狗：LOOP_SLOW_MS>0 时启用，循环被阻塞超过阈值就打出主线程当前调用栈
+- 慢 SQL 日志在 storage 里（SLOW_QUERY_MS）
+"""
+import asyncio, cProfile, hmac, io, logging, os, pstats, sys, threading, time, traceback
+from typing import Optional
+
+log = logging.getLogger("pro-bot.profiling")
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")   # 为空时调试接口一律 404
+LOOP_SLOW_MS = float(os.getenv("LOOP_SLOW_MS", "0"))
+PROFILE_MAX_SECONDS = 300
+
+def check_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+# ===== cProfile 会话 =====
+class ProfileSession:
+    """同一时间只允许一个会话；只采集事件循环线程（处理器/定时任务/序列化都在这里）"""
+
+    def __init__(self):
+        self._prof: Optional[cProfile.Profile] = None
+        self._started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._prof is not None
+
+    def start(self) -> bool:
+        if self._prof is not None:
+            return False
+        self._prof = cProfile.Profile()
+        self._started = time.perf_counter()
+        self._prof.enable()
+        return True
+
+    def stop(self, sort: str = "cumulative", limit: int = 60) -> Optional[str]:
+        prof, self._prof = self._prof, None
+        if prof is None:
+            return None
+        prof.disable()
+        buf = io.StringIO()
+        buf.write(f"profiled {time.perf_counter() - self._started:.1f}s\n")
+        pstats.Stats(prof, stream=buf).strip_dirs().sort_stats(sort).print_stats(limit)
+        return buf.getvalue()
+
+    async def run_for(self, seconds: float, sort: str = "cumulative", limit: int = 60) -> Optional[str]:
+        if not self.start():
+            return None
+        try:
+            await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+        finally:
+            text = self.stop(sort, limit)
+        return text
+
+session = ProfileSession()
+
+# ===== 事件循环看门狗 =====
+class LoopWatchdog:
+    """
+    循环内心跳 + 后台线程检查：心跳超过阈值未更新，说明有协程/回调在同步阻塞循环，
+    此时抓主线程当前栈（sys._current_frames）直接定位是谁。
+    """
+
+    def __init__(self, threshold_ms: float):
+        self.threshold = threshold_ms / 1000
+        self._beat = time.monotonic()
+        self._stop = threading.Event()
+        self._loop_thread = threading.get_ident()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            lag = time.monotonic() - beat
+            if lag <= self.threshold or beat == reported:
+                continue
+            reported = beat  # 同一次阻塞只报一次
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame, limit=20)) if frame else "(no frame)"
+            log.warning(f"event loop blocked for {lag * 1000:.0f}ms (> {self.threshold * 1000:.0f}ms):\n{stack}")
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task: self._task.cancel()
+
+def install_loop_watchdog() -> Optional[LoopWatchdog]:
+    """LOOP_SLOW_MS<=0 时什么都不做"""
+    if LOOP_SLOW_MS <= 0:
+        return None
+    wd = LoopWatchdog(LOOP_SLOW_MS)
+    wd.start()
+    log.info(f"loop watchdog enabled: {LOOP_SLOW_MS:.0f}ms")
+    return wd
@@ -0,0 +1,201 @@
+# app/settings.py
+"""
+群配置：时区 / 工作日程 / 各类休息限制 / 语言。
+
+- 持久化在 chat_settings 表（NULL 字段 = 用默认值）
+- 运行时按群编译成 ChatSettings 缓存在内存里，热路径（打卡/按钮/休息）不再读库
+- 管理员修改后 invalidate，下次访问重新编译
+"""
+import json, time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import pytz
+
+from . import storage
+from .utils import LANG_PACK
+
+# ===== 默认值（未单独配置的群）=====
+DEFAULT_TZ_NAME = "America/New_York"
+DEFAULT_TZ = pytz.timezone(DEFAULT_TZ_NAME)
+DEFAULT_LANG = "zh"
+
+# 工作时间：Mon–Fri 9:00–22:00（提醒/快照/迟到判断用），周末不固定
+DEFAULT_SCHEDULE: Dict[int, Tuple[int, int, int, int]] = {
+    0: (9, 0, 22, 0),  # Mon
+    1: (9, 0, 22, 0),  # Tue
+    2: (9, 0, 22, 0),  # Wed
+    3: (9, 0, 22, 0),  # Thu
+    4: (9, 0, 22, 0),  # Fri
+    5: (0, 0, 0, 0),   # Sat - 不用于提醒
+    6: (0, 0, 0, 0),   # Sun - 不用于提醒
+}
+OFF_DAY = (0, 0, 0, 0)
+
+# 休息限制：kind -> (单次上限分钟, 每日次数)
+DEFAULT_LIMITS: Dict[str, Tuple[int, int]] = {
+    "smoke":   (10, 10),
+    "toilet":  (15, 5),
+    "takeout": (15, 3),
+}
+
+Bounds = Tuple[int, int, datetime, datetime]  # (start_ts, end_ts, start_local, end_local)
+
+class ChatSettings:
+    """编译后的群配置；当天/本周边界按时区缓存，跨天才重新 localize"""
+    __slots__ = ("chat_id", "lang", "tz_name", "tz", "schedule", "limits", "_day", "_week")
+
+    def __init__(self, chat_id: int, lang: str, tz_name: str,
+                 schedule: Dict[int, Tuple[int, int, int, int]], limits: Dict[str, Tuple[int, int]]):
+        self.chat_id = chat_id
+        self.lang = lang
+        self.tz_name = tz_name
+        self.tz = pytz.timezone(tz_name)
+        self.schedule = schedule
+        self.limits = limits
+        self._day: Optional[Bounds] = None
+        self._week: Optional[Bounds] = None
+
+    @property
+    def tz_label(self) -> str:
+        return "ET" if self.tz_name == DEFAULT_TZ_NAME else self.tz_name
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def is_workday(self, weekday: int) -> bool:
+        return self.schedule.get(weekday, OFF_DAY) != OFF_DAY
+
+    def limit(self, kind: str) -> Tuple[int, int]:
+        return self.limits.get(kind, DEFAULT_LIMITS["toilet"])
+
+    # ----- 日/周边界 -----
+    def day_bounds_for(self, dt_local: datetime) -> Bounds:
+        start_local = self.tz.localize(datetime(dt_local.year, dt_local.month, dt_local.day))
+        nxt = start_local.date() + timedelta(days=1)
+        end_local = self.tz.localize(datetime(nxt.year, nxt.month, nxt.day)) - timedelta(seconds=1)
+        return int(start_local.timestamp()), int(end_local.timestamp()), start_local, end_local
+
+    def week_bounds_for(self, dt_local: datetime) -> Bounds:
+        monday = dt_local.date() - timedelta(days=dt_local.weekday())
+        nxt = monday + timedelta(days=7)
+        start_local = self.tz.localize(datetime(monday.year, monday.month, monday.day))
+        end_local = self.tz.localize(datetime(nxt.year, nxt.month, nxt.day)) - timedelta(seconds=1)
+        return int(start_local.timestamp()), int(end_local.timestamp()), start_local, end_local
+
+    def today(self) -> Bounds:
+        now_ts = time.time()
+        d = self._day
+        if d is None or not (d[0] <= now_ts < d[1] + 1):
+            d = self._day = self.day_bounds_for(datetime.fromtimestamp(now_ts, self.tz))
+        return d
+
+    def this_week(self) -> Bounds:
+        now_ts = time.time()
+        w = self._week
+        if w is None or not (w[0] <= now_ts < w[1] + 1):
+            w = self._week = self.week_bounds_for(datetime.fromtimestamp(now_ts, self.tz))
+        return w
+
+# ===== 解析/校验（管理员命令 & 库里的 JSON 共用）=====
+def parse_tz(name: str) -> str:
+    try:
+        return pytz.timezone(name).zone
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"未知时区：{name}（例：America/New_York、Asia/Shanghai）")
+
+def parse_lang(lang: str) -> str:
+    if lang not in LANG_PACK:
+        raise ValueError(f"不支持的语言：{lang}（可选：{'/'.join(LANG_PACK)}）")
+    return lang
+
+def parse_limit(kind: str, minutes: str, per_day: str) -> Tuple[str, Tuple[int, int]]:
+    if kind not in DEFAULT_LIMITS:
+        raise ValueError(f"未知类型：{kind}（可选：{'/'.join(DEFAULT_LIMITS)}）")
+    try:
+        m, n = int(minutes), int(per_day)
+    except ValueError:
+        raise ValueError("分钟/次数需为整数")
+    if m <= 0 or n <= 0:
+        raise ValueError("分钟/次数需大于 0")
+    return kind, (m, n)
+
+def parse_schedule(days: str, span: str) -> Dict[int, Tuple[int, int, int, int]]:
+    """days: '0-4' / '5' / '0,2,4'（0=周一）；span: '09:00-22:00' 或 'off'"""
+    try:
+        wds = set()
+        for part in days.split(","):
+            a, _, b = part.partition("-")
+            wds.update(range(int(a), int(b or a) + 1))
+        if not wds or min(wds) < 0 or max(wds) > 6:
+            raise ValueError
+    except ValueError:
+        raise ValueError("星期格式：0-4 / 5 / 0,2,4（0=周一）")
+    if span.lower() == "off":
+        return {wd: OFF_DAY for wd in wds}
+    try:
+        s, e = span.split("-")
+        sh, sm = map(int, s.split(":")); eh, em = map(int, e.split(":"))
+        assert 0 <= sh < 24 and 0 <= eh < 24 and 0 <= sm < 60 and 0 <= em < 60
+    except (ValueError, AssertionError):
+        raise ValueError("时间格式：09:00-22:00 或 off")
+    return {wd: (sh, sm, eh, em) for wd in wds}
+
+def compile_settings(chat_id: int, row: Optional[Tuple]) -> ChatSettings:
+    lang, tz_name, schedule_json, limits_json = row or (None, None, None, None)
+    schedule = dict(DEFAULT_SCHEDULE)
+    if schedule_json:
+        schedule.update({int(k): tuple(v) for k, v in json.loads(schedule_json).items()})
+    limits = dict(DEFAULT_LIMITS)
+    if limits_json:
+        limits.update({k: tuple(v) for k, v in json.loads(limits_json).items() if k in DEFAULT_LIMITS})
+    return ChatSettings(chat_id, lang or DEFAULT_LANG, tz_name or DEFAULT_TZ_NAME, schedule, limits)
+
+# ===== 缓存 =====
+_cache: Dict[int, ChatSettings] = {}
+_epoch = 0  # 每次失效 +1；读库期间有人改配置就不写回缓存（get 重读，warm 放弃），避免缓存旧值
+
+async def get(chat_id: int) -> ChatSettings:
+    cfg = _cache.get(chat_id)
+    while cfg is None:
+        epoch = _epoch
+        row = await storage.get_chat_settings(chat_id)
+        if epoch == _epoch:
+            cfg = _cache[chat_id] = compile_settings(chat_id, row)
+    return cfg
+
+async def warm() -> int:
+    """开机后台预热：一次读出所有已配置的群并编译，返回预热的群数"""
+    epoch = _epoch
+    rows = await storage.all_chat_settings()
+    if epoch != _epoch:
+        return 0
+    for chat_id, *row in rows:
+        _cache.setdefault(chat_id, compile_settings(chat_id, tuple(row)))
+    return len(rows)
+
+def invalidate(chat_id: Optional[int] = None):
+    global _epoch
+    _epoch += 1
+    if chat_id is None: _cache.clear()
+    else: _cache.pop(chat_id, None)
+
+async def update(chat_id: int, *, lang: Optional[str] = None, tz: Optional[str] = None,
+                 schedule: Optional[Dict[int, Tuple[int, int, int, int]]] = None,
+                 limits: Optional[Dict[str, Tuple[int, int]]] = None) -> ChatSettings:
+    """管理员修改：schedule/limits 为增量覆盖，合并已有的自定义项后整体写回"""
+    cur = await get(chat_id)
+    fields = {}
+    if lang is not None: fields["lang"] = lang
+    if tz is not None: fields["tz"] = tz
+    if schedule is not None:
+        merged = {wd: v for wd, v in cur.schedule.items() if v != DEFAULT_SCHEDULE.get(wd)}
+        merged.update(schedule)
+        fields["schedule"] = json.dumps({str(k): list(v) for k, v in merged.items()})
+    if limits is not None:
+        merged = {k: v for k, v in cur.limits.items() if v != DEFAULT_LIMITS.get(k)}
+        merged.update(limits)
+        fields["limits"] = json.dumps({k: list(v) for k, v in merged.items()})
+    await storage.set_chat_settings(chat_id, **fields)
+    invalidate(chat_id)
+    return await get(chat_id)
@@ -0,0 +1,292 @@
+# app/shard.py
+"""
+按 chat_id 分片的多进程部署：
+
+- 前置进程（front）：只接收 webhook，按 `chat_id % N` 把原始 update 字节转发给对应 worker，
+  等 worker 处理完回 ack 才给 Telegram 回 200；worker 断开时未 ack 的请求回 503，由 Telegram 重投
+  （已处理完但 ack 没送到的会重复处理一次）
+- worker 进程：各自持有一个分片的 SQLite 文件 + 自己的 JobQueue，互不共享；
+  按群排队处理（同 polling.ChatDispatcher：同一群串行，不同群并发）
+- 迁移工具：python -m app.shard rebalance --from 1 --to 4（按新的 N 重新切分数据）
+
+启用：SHARD_COUNT=N（>1 时 python -m app.main 自动进入分片模式）
+"""
+import argparse, asyncio, json, logging, os, sqlite3, struct, subprocess, sys, time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from . import storage
+
+log = logging.getLogger("pro-bot.shard")
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.environ["SHARD_INDEX"]) if os.getenv("SHARD_INDEX") else None  # 仅 worker 进程设置
+SHARD_HOST = "127.0.0.1"
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "9100"))
+# worker 崩溃自动重启；RESTART_WINDOW 秒内同一分片重启超过 RESTART_LIMIT 次则 front 整体退出
+RESTART_LIMIT, RESTART_WINDOW = 5, 60.0
+
+# 帧格式：front -> worker 为 4 字节大端长度 + update 原始 JSON；worker -> front 为 8 字节 update_id（处理完的 ack）
+_HDR = struct.Struct("!I")
+_ACK = struct.Struct("!q")
+
+# 带 chat 的 update 字段
+_CHAT_KEYS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+# 迁移时复制的表与列（不含自增 id，由目标库重新分配）
+_TABLES = {
+    "chat_lang":     "chat_id, lang",
+    "chat_settings": "chat_id, lang, tz, schedule, limits",
+    "checkins":      "chat_id, user_id, username, display_name, ts",
+    "work_sessions": "chat_id, user_id, start_ts, end_ts",
+    "breaks":        "chat_id, user_id, kind, start_ts, end_ts",
+}
+
+# ===== 分片规则 =====
+def shard_of(chat_id: int, count: int) -> int:
+    return chat_id % count
+
+def shard_db_path(base: str, index: int, count: int) -> str:
+    """data.db -> data.s0of4.db；count=1 时就是原文件"""
+    if count <= 1:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}.s{index}of{count}{ext or '.db'}"
+
+def update_chat_id(data: dict) -> Optional[int]:
+    for key in _CHAT_KEYS:
+        obj = data.get(key)
+        if obj and "chat" in obj:
+            return obj["chat"]["id"]
+    cq = data.get("callback_query")
+    if cq and cq.get("message"):
+        return cq["message"]["chat"]["id"]
+    return None
+
+# ===== worker：从本地 socket 读 update =====
+async def serve_worker(app, index: int):
+    """worker 进程主循环：收到的 update 按群排队处理，处理完回 ack"""
+    from telegram import Update
+    from .polling import ChatDispatcher
+
+    dispatcher = ChatDispatcher(app)
+
+    async def on_conn(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def ack(update_id: int):
+            if not writer.is_closing():  # 连接已断：front 那边已回 503，Telegram 会重投
+                writer.write(_ACK.pack(update_id))
+        try:
+            while True:
+                hdr = await reader.readexactly(_HDR.size)
+                raw = await reader.readexactly(_HDR.unpack(hdr)[0])
+                dispatcher.put(Update.de_json(json.loads(raw), app.bot), ack)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(on_conn, SHARD_HOST, SHARD_BASE_PORT + index)
+    log.info(f"shard worker {index}/{SHARD_COUNT} listening on {SHARD_HOST}:{SHARD_BASE_PORT + index} db={storage.DB_PATH}")
+    async with server:
+        await server.serve_forever()
+
+# ===== front：转发 =====
+class ShardRouter:
+    """每个 worker 一条长连接；同一分片串行写入，保证同一群的 update 顺序；forward 等到 worker 处理完才返回"""
+
+    def __init__(self, count: int, base_port: int = SHARD_BASE_PORT):
+        self.count = count
+        self.base_port = base_port
+        # 每个分片：(writer, 该连接上等 ack 的 update_id -> future)
+        self._conns: List[Optional[Tuple[asyncio.StreamWriter, Dict[int, asyncio.Future]]]] = [None] * count
+        self._locks = [asyncio.Lock() for _ in range(count)]
+        self._readers: Set[asyncio.Task] = set()
+
+    async def _conn(self, i: int) -> Tuple[asyncio.StreamWriter, Dict[int, asyncio.Future]]:
+        conn = self._conns[i]
+        if conn is None or conn[0].is_closing():
+            for attempt in range(20):  # worker 刚启动时可能还没监听
+                try:
+                    r, w = await asyncio.open_connection(SHARD_HOST, self.base_port + i)
+                    break
+                except OSError:
+                    if attempt == 19: raise
+                    await asyncio.sleep(0.25)
+            conn = self._conns[i] = (w, {})
+            task = asyncio.create_task(self._read_acks(i, r, conn))
+            self._readers.add(task)
+            task.add_done_callback(self._readers.discard)
+        return conn
+
+    async def _read_acks(self, i: int, reader: asyncio.StreamReader, conn):
+        w, pending = conn
+        try:
+            while True:
+                update_id = _ACK.unpack(await reader.readexactly(_ACK.size))[0]
+                fut = pending.pop(update_id, None)
+                if fut and not fut.done():
+                    fut.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            # worker 断开（崩溃/重启）：这条连接上没 ack 的全部失败，由 Telegram 重投
+            if self._conns[i] is conn:
+                self._conns[i] = None
+            w.close()
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError(f"shard worker {i} disconnected"))
+            pending.clear()
+
+    async def forward(self, raw: bytes) -> int:
+        data = json.loads(raw)
+        chat_id = update_chat_id(data)
+        i = shard_of(chat_id, self.count) if chat_id is not None else 0
+        update_id = data["update_id"]
+        async with self._locks[i]:
+            conn = await self._conn(i)
+            w, pending = conn
+            fut = pending.get(update_id)
+            if fut is None:  # 还在处理中的重投（Telegram 等超时了）不再转发，等同一个 ack
+                fut = pending[update_id] = asyncio.get_running_loop().create_future()
+                try:
+                    w.write(_HDR.pack(len(raw)) + raw)
+                    await w.drain()
+                except (ConnectionError, OSError):
+                    pending.pop(update_id, None)
+                    if self._conns[i] is conn:
+                        self._conns[i] = None  # 下次重连；本次抛出让 Telegram 重投
+                    raise
+        await asyncio.shield(fut)  # 单个请求被取消不影响同一 update 的其他等待者
+        return i
+
+def spawn_worker(i: int, count: int, base_port: int = SHARD_BASE_PORT, **popen) -> subprocess.Popen:
+    base = os.getenv("DB_PATH", "data.db")
+    env = dict(os.environ, SHARD_INDEX=str(i), SHARD_COUNT=str(count), SHARD_BASE_PORT=str(base_port),
+               DB_PATH=shard_db_path(base, i, count))
+    return subprocess.Popen([sys.executable, "-m", "app.main"], env=env, **popen)
+
+def spawn_workers(count: int, base_port: int = SHARD_BASE_PORT, **popen) -> List[subprocess.Popen]:
+    return [spawn_worker(i, count, base_port, **popen) for i in range(count)]
+
+async def supervise(procs: List[subprocess.Popen], count: int, base_port: int = SHARD_BASE_PORT, interval: float = 1.0):
+    """
+    盯着 worker：退出即重启。崩溃时排队/处理中的 update 没有 ack，front 对这些请求回 503，
+    由 Telegram 重投（重启期间到达的也一样）；
+    短时间内反复崩溃说明不是偶发问题，抛出让 front 退出，交给平台重启整个服务。
+    """
+    restarts: List[List[float]] = [[] for _ in procs]
+    while True:
+        await asyncio.sleep(interval)
+        for i, p in enumerate(procs):
+            code = p.poll()
+            if code is None:
+                continue
+            now = time.monotonic()
+            restarts[i] = [t for t in restarts[i] if now - t < RESTART_WINDOW] + [now]
+            if len(restarts[i]) > RESTART_LIMIT:
+                raise RuntimeError(f"shard worker {i} crashed {len(restarts[i])} times in {RESTART_WINDOW:.0f}s (exit {code})")
+            log.error(f"shard worker {i} exited with {code}; restarting")
+            procs[i] = spawn_worker(i, count, base_port)
+
+async def run_front(token: str, commands: Sequence[Tuple[str, str]], base_url: str, secret: str, port: int):
+    import uvicorn
+    from fastapi import FastAPI, Request
+    from fastapi.responses import PlainTextResponse
+    from telegram import Bot
+
+    procs = spawn_workers(SHARD_COUNT)
+    router = ShardRouter(SHARD_COUNT)
+    api = FastAPI()
+
+    @api.get("/healthz")
+    async def healthz(): return PlainTextResponse("ok")
+
+    @api.post(f"/webhook/{secret}")
+    async def webhook(request: Request):
+        try:
+            await router.forward(await request.body())
+        except (ConnectionError, OSError) as e:
+            log.warning(f"forward failed, asking Telegram to redeliver: {e}")
+            return PlainTextResponse("worker unavailable", status_code=503)
+        return PlainTextResponse("ok")
+
+    try:
+        async with Bot(token) as bot:
+            await bot.set_my_commands(commands)
+            await bot.set_webhook(url=f"{base_url}/webhook/{secret}")
+        server = uvicorn.Server(uvicorn.Config(api, host="0.0.0.0", port=port))
+        serve_task = asyncio.create_task(server.serve())
+        watch_task = asyncio.create_task(supervise(procs, SHARD_COUNT))
+        await asyncio.wait({serve_task, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+        if watch_task.done():
+            server.should_exit = True  # worker 反复崩溃：停止接收，非零退出
+            await serve_task
+            watch_task.result()
+        watch_task.cancel()
+    finally:
+        for p in procs: p.terminate()
+        for p in procs: p.wait()
+
+# ===== 迁移：按新的分片数重新切分 =====
+def rebalance(base: str, old: int, new: int) -> List[int]:
+    """
+    把 old 个分片文件的数据重新切到 new 个新文件（旧文件不动，确认无误后再切换 SHARD_COUNT）。
+    目标文件已存在（如 --to 1 时的原库，多半是分片前留下的旧数据）则先改名为 <文件>.bak-<时间> 再写。
+    返回每个新分片的行数。
+    """
+    if old == new:
+        raise SystemExit("--from 与 --to 相同，无需迁移")
+    sources = [shard_db_path(base, i, old) for i in range(old)]
+    for src in sources:
+        if not os.path.exists(src):
+            raise SystemExit(f"源文件不存在：{src}")
+    targets = [shard_db_path(base, j, new) for j in range(new)]
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    for p in targets:
+        if os.path.exists(p):
+            bak = f"{p}.bak-{stamp}"
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(p + suffix):
+                    os.replace(p + suffix, bak + suffix)
+            print(f"目标文件已存在，已改名为 {bak}")
+        asyncio.run(storage.init_db(p))
+
+    counts = [0] * new
+    for src in sources:
+        for j, dst in enumerate(targets):
+            con = sqlite3.connect(dst)
+            try:
+                con.execute("ATTACH DATABASE ? AS src", (src,))
+                with con:
+                    for table, cols in _TABLES.items():
+                        # SQLite 的 % 对负数取截断余数，需规整成与 Python 一致
+                        cur = con.execute(
+                            f"INSERT INTO main.{table}({cols}) SELECT {cols} FROM src.{table} "
+                            f"WHERE ((chat_id % ?) + ?) % ? = ? ORDER BY rowid",
+                            (new, new, new, j),
+                        )
+                        counts[j] += cur.rowcount
+                con.execute("DETACH DATABASE src")
+            finally:
+                con.close()
+    return counts
+
+def _cli(argv=None):
+    p = argparse.ArgumentParser(prog="python -m app.shard")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    rb = sub.add_parser("rebalance", help="按新的分片数重新切分数据库")
+    rb.add_argument("--from", dest="old", type=int, required=True)
+    rb.add_argument("--to", dest="new", type=int, required=True)
+    rb.add_argument("--db", default=os.getenv("DB_PATH", "data.db"))
+    args = p.parse_args(argv)
+
+    counts = rebalance(args.db, args.old, args.new)
+    for j, n in enumerate(counts):
+        print(f"{shard_db_path(args.db, j, args.new)}: {n} 行")
+    print(f"完成。确认后设置 SHARD_COUNT={args.new} 重启。")
+
+if __name__ == "__main__":
+    _cli()
@@ -1,13 +1,67 @@
 # app/storage.py
-import os
+import asyncio, heapq, os, time, logging, sqlite3
 import aiosqlite
-from typing import List, Tuple, Optional
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple, Optional
+from urllib.parse import quote
+
+from . import metrics
 
 DB_PATH = os.getenv("DB_PATH", "data.db")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 = 关闭慢 SQL 日志
+
+slowlog = logging.getLogger("pro-bot.slowsql")
+
+# 正在生成的报表数；写锁等待按有无报表分开记，用于确认报表不拖慢打卡
+_active_reports = 0
+_LOCK_WAIT = {
+    busy: metrics.histogram("bot_sqlite_write_lock_wait_ms", "写事务拿锁（BEGIN IMMEDIATE）等待", report=busy)
+    for busy in ("idle", "active")
+}
+
+# ========= 基础：连接 =========
+class _TimedConnection(sqlite3.Connection):
+    """慢 SQL 日志：仅在 SLOW_QUERY_MS>0 时作为 sqlite3 连接工厂使用"""
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            if ms >= SLOW_QUERY_MS:
+                # 命名参数（:n）传的是 dict，tuple() 只会留下键名
+                params = dict(parameters) if isinstance(parameters, Mapping) else tuple(parameters)
+                slowlog.warning(f"slow sql {ms:.1f}ms: {' '.join(sql.split())} params={params!r}")
+
+    def commit(self):
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            if ms >= SLOW_QUERY_MS:
+                slowlog.warning(f"slow sql {ms:.1f}ms: COMMIT")
+
+def _connect(path: Optional[str] = None, **kwargs) -> aiosqlite.Connection:
+    if SLOW_QUERY_MS > 0:
+        kwargs["factory"] = _TimedConnection
+    return aiosqlite.connect(path or DB_PATH, **kwargs)
 
 # ========= 基础：初始化 =========
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+# 二级索引（app/import.py 按自然键去重也靠这几条）
+INDEXES: List[Tuple[str, str]] = [
+    ("idx_checkins_chat_ts",            "checkins(chat_id, ts)"),
+    ("idx_checkins_user_ts",            "checkins(user_id, ts)"),
+    ("idx_work_chat_user_start",        "work_sessions(chat_id, user_id, start_ts)"),
+    ("idx_work_chat_user_end",          "work_sessions(chat_id, user_id, end_ts)"),
+    ("idx_breaks_chat_user_kind_start", "breaks(chat_id, user_id, kind, start_ts)"),
+    ("idx_breaks_chat_user_end",        "breaks(chat_id, user_id, end_ts)"),
+]
+
+async def init_db(db_path: Optional[str] = None):
+    async with _connect(db_path) as db:
         await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS chat_lang (
@@ -15,6 +69,29 @@ async def init_db():
             lang       TEXT NOT NULL
         );
         """)
+        # 群配置：NULL 字段表示使用默认值（见 settings.py）
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id    INTEGER PRIMARY KEY,
+            lang       TEXT,
+            tz         TEXT,
+            schedule   TEXT,    -- JSON {"0": [9,0,22,0], ...}（只存与默认不同的天）
+            limits     TEXT     -- JSON {"smoke": [10,10], ...}（分钟, 每日次数）
+        );
+        """)
+        # 运行时元数据（如 Bot API 菜单/webhook 的指纹，用于开机跳过未变化的设置）
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key    TEXT PRIMARY KEY,
+            value  TEXT
+        );
+        """)
+        # 旧版 chat_lang 迁移到 chat_settings（已存在的不覆盖）；只做一次，用 user_version 记录
+        async with db.execute("PRAGMA user_version") as cur:
+            version = (await cur.fetchone())[0]
+        if version < 1:
+            await db.execute("INSERT OR IGNORE INTO chat_settings(chat_id, lang) SELECT chat_id, lang FROM chat_lang")
+            await db.execute("PRAGMA user_version=1")
         await db.execute("""
         CREATE TABLE IF NOT EXISTS checkins (
             id           INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,32 +122,149 @@ async def init_db():
         );
         """)
         # 索引
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_checkins_chat_ts ON checkins(chat_id, ts);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_checkins_user_ts ON checkins(user_id, ts);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_work_chat_user_start ON work_sessions(chat_id, user_id, start_ts);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_work_chat_user_end   ON work_sessions(chat_id, user_id, end_ts);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_breaks_chat_user_kind_start ON breaks(chat_id, user_id, kind, start_ts);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_breaks_chat_user_end ON breaks(chat_id, user_id, end_ts);")
+        for name, on in INDEXES:
+            await db.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {on};")
+        await db.commit()
+
+# ========= 连接：写入 / 报表只读快照 =========
+# 进程内写事务排队：几十个并发写各自在 busy_timeout 里轮询抢锁既不公平也会超时（5 秒后 database is locked），
+# 先在事件循环里按先来后到排队，BEGIN IMMEDIATE 只用于和其他进程（导入、备份）互斥
+_write_lock: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Lock]] = None
+
+def _get_write_lock() -> asyncio.Lock:
+    global _write_lock
+    loop = asyncio.get_running_loop()
+    if _write_lock is None or _write_lock[0] is not loop:  # 每个事件循环一把（命令行工具可能多次 asyncio.run）
+        _write_lock = (loop, asyncio.Lock())
+    return _write_lock[1]
+
+@asynccontextmanager
+async def _write_conn():
+    """写连接：进程内排队后显式 BEGIN IMMEDIATE，统计排队 + 拿写锁的等待时间；调用方没提交的部分在退出时回滚"""
+    async with _connect() as db:
+        busy = "active" if _active_reports else "idle"
+        t0 = time.perf_counter()
+        async with _get_write_lock():
+            await db.execute("BEGIN IMMEDIATE")
+            _LOCK_WAIT[busy].observe((time.perf_counter() - t0) * 1000)
+            try:
+                yield db
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
+
+@asynccontextmanager
+async def report_snapshot():
+    """
+    报表专用只读连接：mode=ro + query_only，整份报表在同一个 DEFERRED 读事务里完成。
+    WAL 下读事务只固定一个快照、不持有写锁，所以报表前后一致，也不会挡住下班/回座的写入。
+    """
+    global _active_reports
+    _active_reports += 1
+    uri = f"file:{quote(os.path.abspath(DB_PATH))}?mode=ro"
+    try:
+        async with _connect(uri, uri=True, isolation_level=None) as db:
+            await db.execute("PRAGMA query_only=ON")
+            await db.execute("BEGIN DEFERRED")
+            try:
+                yield db
+            finally:
+                await db.execute("ROLLBACK")
+    finally:
+        _active_reports -= 1
+
+@asynccontextmanager
+async def _report_conn(db: Optional[aiosqlite.Connection]):
+    """调用方已开快照则复用（同一份报表的多次查询共享快照），否则自开一个"""
+    if db is not None:
+        yield db
+        return
+    async with report_snapshot() as snap:
+        yield snap
+
+# ========= 数据版本（用于报表缓存失效）=========
+# 进程内：每个群一个递增计数，bot 自己写入后 +1（分片模式下每个群只归一个进程写）
+# 库内：meta.data_epoch，离线导入/恢复时换新值（它们不经过 bot 进程，见 app/import.py、app/backup.py）
+DATA_EPOCH_KEY = "data_epoch"
+_generation: Dict[int, int] = {}
+
+async def data_generation(chat_id: int) -> Tuple[Optional[str], int]:
+    return await get_meta(DATA_EPOCH_KEY), _generation.get(chat_id, 0)
+
+def bump_generation(chat_id: int) -> None:
+    _generation[chat_id] = _generation.get(chat_id, 0) + 1
+
+def bump_data_epoch(con: sqlite3.Connection) -> None:
+    """在同步连接上换一个新的 data_epoch（由调用方提交）"""
+    con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    con.execute("INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (DATA_EPOCH_KEY, str(time.time_ns())))
+
+def open_end(end_ts: int) -> int:
+    """未结束的上班/休息算到 min(区间结束, 现在)；现在取整到分钟，区间报表缓存一分钟内可复用"""
+    return min(end_ts, int(time.time()) // 60 * 60)
+
+# ========= 群配置 =========
+_SETTING_FIELDS = ("lang", "tz", "schedule", "limits")
+
+@metrics.timed_sql("get_chat_settings")
+async def get_chat_settings(chat_id: int) -> Optional[Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]]:
+    """返回 (lang, tz, schedule_json, limits_json)；未配置过返回 None"""
+    async with _connect() as db:
+        async with db.execute(
+            "SELECT lang, tz, schedule, limits FROM chat_settings WHERE chat_id=?", (chat_id,)
+        ) as cur:
+            return await cur.fetchone()
+
+@metrics.timed_sql("all_chat_settings")
+async def all_chat_settings() -> List[Tuple[int, Optional[str], Optional[str], Optional[str], Optional[str]]]:
+    """开机预热用：[(chat_id, lang, tz, schedule_json, limits_json)]"""
+    async with _connect() as db:
+        async with db.execute("SELECT chat_id, lang, tz, schedule, limits FROM chat_settings") as cur:
+            return await cur.fetchall()
+
+@metrics.timed_sql("set_chat_settings")
+async def set_chat_settings(chat_id: int, **fields) -> None:
+    cols = [k for k in _SETTING_FIELDS if k in fields]
+    if not cols:
+        return
+    async with _write_conn() as db:
+        await db.execute(
+            f"INSERT INTO chat_settings(chat_id, {', '.join(cols)}) VALUES(?{', ?' * len(cols)}) "
+            f"ON CONFLICT(chat_id) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in cols)}",
+            (chat_id, *[fields[c] for c in cols]),
+        )
         await db.commit()
 
-# ========= 语言 =========
-async def get_lang(chat_id: int) -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT lang FROM chat_lang WHERE chat_id=?", (chat_id,)) as cur:
+# ========= 元数据 =========
+@metrics.timed_sql("get_meta")
+async def get_meta(key: str) -> Optional[str]:
+    async with _connect() as db:
+        async with db.execute("SELECT value FROM meta WHERE key=?", (key,)) as cur:
             row = await cur.fetchone()
-            return row[0] if row else "zh"
+            return row[0] if row else None
+
+@metrics.timed_sql("set_meta")
+async def set_meta(key: str, value: str) -> None:
+    async with _write_conn() as db:
+        await db.execute("INSERT INTO meta(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                         (key, value))
+        await db.commit()
 
 # ========= 签到 =========
+@metrics.timed_sql("add_checkin")
 async def add_checkin(chat_id: int, user_id: int, username: str, display_name: str, ts: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_conn() as db:
         await db.execute(
             "INSERT INTO checkins(chat_id, user_id, username, display_name, ts) VALUES(?,?,?,?,?)",
             (chat_id, user_id, username, display_name, ts),
         )
         await db.commit()
+        bump_generation(chat_id)
 
+@metrics.timed_sql("has_checkin_between")
 async def has_checkin_between(chat_id: int, user_id: int, start_ts: int, end_ts: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect() as db:
         async with db.execute(
             "SELECT 1 FROM checkins WHERE chat_id=? AND user_id=? AND ts BETWEEN ? AND ? LIMIT 1",
             (chat_id, user_id, start_ts, end_ts),
@@ -86,11 +280,12 @@ async def _get_active_work_id(db: aiosqlite.Connection, chat_id: int, user_id: i
         r = await cur.fetchone()
         return r[0] if r else None
 
+@metrics.timed_sql("start_work")
 async def start_work(chat_id: int, user_id: int, start_ts: int) -> bool:
     """
     开始上班。若已在上班中返回 False，否则创建并返回 True
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_conn() as db:
         if await _get_active_work_id(db, chat_id, user_id) is not None:
             return False
         await db.execute(
@@ -98,34 +293,38 @@ async def start_work(chat_id: int, user_id: int, start_ts: int) -> bool:
             (chat_id, user_id, start_ts),
         )
         await db.commit()
+        bump_generation(chat_id)
         return True
 
+@metrics.timed_sql("stop_work")
 async def stop_work(chat_id: int, user_id: int, end_ts: int) -> Optional[int]:
     """
     结束上班，返回本次分钟数；若当前不在上班中返回 None
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_conn() as db:
         wid = await _get_active_work_id(db, chat_id, user_id)
         if wid is None:
             return None
         await db.execute("UPDATE work_sessions SET end_ts=? WHERE id=?", (end_ts, wid))
         await db.commit()
+        bump_generation(chat_id)
         # 计算分钟
         async with db.execute("SELECT start_ts, COALESCE(end_ts, ?) FROM work_sessions WHERE id=?",
                               (end_ts, wid)) as cur:
             s, e = await cur.fetchone()
             return max(0, (int(e) - int(s)) // 60)
 
+@metrics.timed_sql("work_minutes_between")
 async def work_minutes_between(chat_id: int, user_id: int, start_ts: int, end_ts: int) -> int:
     """
-    统计与 [start_ts, end_ts] 区间有交集的上班分钟数（按交集裁剪）
+    统计与 [start_ts, end_ts] 区间有交集的上班分钟数（按交集裁剪；未结束的算到现在）
     """
-    total = 0
-    async with aiosqlite.connect(DB_PATH) as db:
+    total, now = 0, open_end(end_ts)
+    async with _connect() as db:
         async with db.execute(
             "SELECT start_ts, COALESCE(end_ts, ?) FROM work_sessions "
             "WHERE chat_id=? AND user_id=? AND NOT (COALESCE(end_ts, ?) < ? OR start_ts > ?)",
-            (end_ts, chat_id, user_id, end_ts, start_ts, end_ts),
+            (now, chat_id, user_id, now, start_ts, end_ts),
         ) as cur:
             async for s, e in cur:
                 s2, e2 = max(s, start_ts), min(e, end_ts)
@@ -134,27 +333,31 @@ async def work_minutes_between(chat_id: int, user_id: int, start_ts: int, end_ts
     return int(total)
 
 # ========= 休息（抽烟/如厕/取外卖） =========
+@metrics.timed_sql("has_active_break")
 async def has_active_break(chat_id: int, user_id: int, kind: str) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect() as db:
         async with db.execute(
             "SELECT 1 FROM breaks WHERE chat_id=? AND user_id=? AND kind=? AND end_ts IS NULL LIMIT 1",
             (chat_id, user_id, kind),
         ) as cur:
             return await cur.fetchone() is not None
 
+@metrics.timed_sql("start_break")
 async def start_break(chat_id: int, user_id: int, kind: str, start_ts: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_conn() as db:
         await db.execute(
             "INSERT INTO breaks(chat_id, user_id, kind, start_ts) VALUES(?,?,?,?)",
             (chat_id, user_id, kind, start_ts),
         )
         await db.commit()
+        bump_generation(chat_id)
 
+@metrics.timed_sql("stop_break")
 async def stop_break(chat_id: int, user_id: int, kind: str, end_ts: int) -> Optional[int]:
     """
     停止某种休息，返回本次分钟数；若没有进行中则返回 None
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write_conn() as db:
         async with db.execute(
             "SELECT id, start_ts FROM breaks WHERE chat_id=? AND user_id=? AND kind=? AND end_ts IS NULL "
             "ORDER BY id DESC LIMIT 1",
@@ -166,10 +369,12 @@ async def stop_break(chat_id: int, user_id: int, kind: str, end_ts: int) -> Opti
             bid, s = r
         await db.execute("UPDATE breaks SET end_ts=? WHERE id=?", (end_ts, bid))
         await db.commit()
+        bump_generation(chat_id)
         return max(0, (int(end_ts) - int(s)) // 60)
 
+@metrics.timed_sql("count_breaks_between")
 async def count_breaks_between(chat_id: int, user_id: int, kind: str, start_ts: int, end_ts: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect() as db:
         async with db.execute(
             "SELECT COUNT(*) FROM breaks WHERE chat_id=? AND user_id=? AND kind=? AND start_ts BETWEEN ? AND ?",
             (chat_id, user_id, kind, start_ts, end_ts),
@@ -177,11 +382,19 @@ async def count_breaks_between(chat_id: int, user_id: int, kind: str, start_ts:
             r = await cur.fetchone()
             return int(r[0] if r else 0)
 
+@metrics.timed_sql("count_open_breaks")
+async def count_open_breaks() -> int:
+    async with _connect() as db:
+        async with db.execute("SELECT COUNT(*) FROM breaks WHERE end_ts IS NULL") as cur:
+            r = await cur.fetchone()
+            return int(r[0] if r else 0)
+
 # ========= 汇总（用于快照/日报/周报） =========
 async def _sum_break_minutes(db: aiosqlite.Connection, chat_id: int, kind: str, start_ts: int, end_ts: int) -> Tuple[int, int]:
     """
-    返回 (次数, 分钟数)，分钟按区间裁剪。
+    返回 (次数, 分钟数)，分钟按区间裁剪；未结束的算到现在。
     """
+    now = open_end(end_ts)
     # 次数：按开始时间落在区间内统计
     async with db.execute(
         "SELECT COUNT(*) FROM breaks WHERE chat_id=? AND kind=? AND start_ts BETWEEN ? AND ?",
@@ -195,7 +408,7 @@ async def _sum_break_minutes(db: aiosqlite.Connection, chat_id: int, kind: str,
     async with db.execute(
         "SELECT start_ts, COALESCE(end_ts, ?) FROM breaks "
         "WHERE chat_id=? AND kind=? AND NOT (COALESCE(end_ts, ?) < ? OR start_ts > ?)",
-        (end_ts, chat_id, kind, end_ts, start_ts, end_ts),
+        (now, chat_id, kind, now, start_ts, end_ts),
     ) as cur:
         async for s, e in cur:
             s2, e2 = max(s, start_ts), min(e, end_ts)
@@ -203,20 +416,23 @@ async def _sum_break_minutes(db: aiosqlite.Connection, chat_id: int, kind: str,
                 minutes += (e2 - s2) // 60
     return cnt, int(minutes)
 
-async def summarize_between(chat_id: int, start_ts: int, end_ts: int) -> Tuple[int, int, int, int, int, List[Tuple[str,int]]]:
+@metrics.timed_sql("summarize_between")
+async def summarize_between(chat_id: int, start_ts: int, end_ts: int,
+                            db: Optional[aiosqlite.Connection] = None) -> Tuple[int, int, int, int, int, List[Tuple[str,int]]]:
     """
     基于上班记录的汇总：
       c              -> 区间内有上班记录的“人数”（distinct user_id，按与区间有交集的 work_sessions 计算）
       s_cnt, s_min   -> 吸烟次数 & 分钟（与原来一致）
       t_cnt, t_min   -> 如厕次数 & 分钟（与原来一致）
       top            -> Top5：按“本区间内开始的上班次数”排序 [(name, cnt), ...]
+    在报表只读快照上执行（见 report_snapshot）。
     """
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _report_conn(db) as db:
         # 人数：与区间有交集的 work_sessions 的去重 user
         async with db.execute(
             "SELECT COUNT(DISTINCT user_id) FROM work_sessions "
             "WHERE chat_id=? AND NOT (COALESCE(end_ts, ?) < ? OR start_ts > ?)",
-            (chat_id, end_ts, start_ts, end_ts),
+            (chat_id, open_end(end_ts), start_ts, end_ts),
         ) as cur:
             rc = await cur.fetchone()
             c = int(rc[0] if rc else 0)
@@ -247,87 +463,166 @@ async def summarize_between(chat_id: int, start_ts: int, end_ts: int) -> Tuple[i
     return c, s_cnt, s_min, t_cnt, t_min, top
 
 # ========= 规则/日报辅助 =========
+@metrics.timed_sql("work_started_between")
 async def work_started_between(chat_id: int, user_id: int, start_ts: int, end_ts: int) -> bool:
     """今天是否已经“上班打卡”（按 work_sessions.start_ts 判断）"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _connect() as db:
         async with db.execute(
             "SELECT 1 FROM work_sessions WHERE chat_id=? AND user_id=? AND start_ts BETWEEN ? AND ? LIMIT 1",
             (chat_id, user_id, start_ts, end_ts),
         ) as cur:
             return await cur.fetchone() is not None
 
-async def daily_person_summary(chat_id: int, start_ts: int, end_ts: int):
+# 日报按人汇总：一条分组查询，按排序顺序流式返回（代替逐人查询）；:n = open_end(:e)
+_PERSON_USERS_CTE = """
+WITH u AS (
+    SELECT user_id FROM checkins WHERE chat_id=:c AND ts BETWEEN :s AND :e
+    UNION
+    SELECT user_id FROM breaks WHERE chat_id=:c AND start_ts BETWEEN :s AND :e
+    UNION
+    SELECT user_id FROM work_sessions
+     WHERE chat_id=:c AND NOT (COALESCE(end_ts, :n) < :s OR start_ts > :e)
+)
+"""
+
+_PERSON_SUMMARY_SQL = _PERSON_USERS_CTE + """,
+w AS (
+    SELECT user_id,
+           SUM(MAX(0, MIN(COALESCE(end_ts, :n), :e) - MAX(start_ts, :s)) / 60) AS work_min
+      FROM work_sessions
+     WHERE chat_id=:c AND NOT (COALESCE(end_ts, :n) < :s OR start_ts > :e)
+     GROUP BY user_id
+),
+b AS (
+    SELECT user_id, SUM(kind='toilet') AS toilet_cnt, SUM(kind='takeout') AS takeout_cnt
+      FROM breaks
+     WHERE chat_id=:c AND start_ts BETWEEN :s AND :e
+     GROUP BY user_id
+)
+SELECT u.user_id,
+       COALESCE(NULLIF((SELECT COALESCE(display_name, username, CAST(user_id AS TEXT)) FROM checkins
+                         WHERE user_id=u.user_id AND chat_id=:c ORDER BY ts DESC LIMIT 1), ''),
+                CAST(u.user_id AS TEXT)) AS name,
+       COALESCE(w.work_min, 0), COALESCE(b.toilet_cnt, 0), COALESCE(b.takeout_cnt, 0)
+  FROM u
+  LEFT JOIN w ON w.user_id = u.user_id
+  LEFT JOIN b ON b.user_id = u.user_id
+ ORDER BY 3 DESC, 4, 5, 2
+"""
+
+@metrics.timed_sql("count_daily_persons")
+async def count_daily_persons(chat_id: int, start_ts: int, end_ts: int, db: Optional[aiosqlite.Connection] = None) -> int:
+    """日报人数（用于决定分段发送还是发 CSV 附件）"""
+    async with _report_conn(db) as db:
+        async with db.execute(_PERSON_USERS_CTE + "SELECT COUNT(*) FROM u",
+                              {"c": chat_id, "s": start_ts, "e": end_ts, "n": open_end(end_ts)}) as cur:
+            r = await cur.fetchone()
+            return int(r[0] if r else 0)
+
+async def iter_daily_person_summary(chat_id: int, start_ts: int, end_ts: int, db: Optional[aiosqlite.Connection] = None):
+    """
+    流式版 daily_person_summary：按日报顺序逐行产出 dict，不在内存里攒整张表。
+    传入 db（report_snapshot）时与同一份报表的其他查询共享快照。
+    """
+    async with _report_conn(db) as db:
+        params = {"c": chat_id, "s": start_ts, "e": end_ts, "n": open_end(end_ts)}
+        async with db.execute(_PERSON_SUMMARY_SQL, params) as cur:
+            async for uid, name, work_min, toilet_cnt, takeout_cnt in cur:
+                yield {
+                    "user_id": uid,
+                    "name": name or str(uid),
+                    "work_min": int(work_min),
+                    "toilet_cnt": int(toilet_cnt),
+                    "takeout_cnt": int(takeout_cnt),
+                }
+
+@metrics.timed_sql("daily_person_summary")
+async def daily_person_summary(chat_id: int, start_ts: int, end_ts: int, db: Optional[aiosqlite.Connection] = None):
     """
     返回列表：[{'user_id':..., 'name':..., 'work_min':..., 'toilet_cnt':..., 'takeout_cnt':...}, ...]
     - work_min：按区间裁剪后的上班分钟
     - toilet_cnt / takeout_cnt：区间内开始次数
+    在报表只读快照上执行（见 report_snapshot）。
     """
-    rows = []
-    async with aiosqlite.connect(DB_PATH) as db:
-        # 用户集合：checkins / breaks / work_sessions
-        users = set()
+    return [r async for r in iter_daily_person_summary(chat_id, start_ts, end_ts, db)]
 
-        async with db.execute(
-            "SELECT DISTINCT user_id FROM checkins WHERE chat_id=? AND ts BETWEEN ? AND ?",
-            (chat_id, start_ts, end_ts),
-        ) as cur:
-            users.update([r[0] for r in await cur.fetchall()])
+# ========= 组织汇总（所有群一次分组查询） =========
+BREAK_KINDS = ("smoke", "toilet", "takeout")
 
-        async with db.execute(
-            "SELECT DISTINCT user_id FROM breaks WHERE chat_id=? AND start_ts BETWEEN ? AND ?",
-            (chat_id, start_ts, end_ts),
-        ) as cur:
-            users.update([r[0] for r in await cur.fetchall()])
+# 与 summarize_between / 日报同口径：上班、休息分钟按区间裁剪、逐条取整；休息次数按区间内开始计
+_ORG_WORK_SQL = """
+SELECT chat_id, user_id,
+       SUM(MAX(0, MIN(COALESCE(end_ts, :n), :e) - MAX(start_ts, :s)) / 60) AS work_min
+  FROM work_sessions
+ WHERE NOT (COALESCE(end_ts, :n) < :s OR start_ts > :e)
+ GROUP BY chat_id, user_id
+"""
 
-        async with db.execute(
-            "SELECT DISTINCT user_id FROM work_sessions "
-            "WHERE chat_id=? AND NOT (COALESCE(end_ts, ?) < ? OR start_ts > ?)",
-            (chat_id, end_ts, start_ts, end_ts),
-        ) as cur:
-            users.update([r[0] for r in await cur.fetchall()])
+_ORG_BREAKS_SQL = """
+SELECT chat_id, kind,
+       SUM(start_ts BETWEEN :s AND :e) AS cnt,
+       SUM(MAX(0, MIN(COALESCE(end_ts, :n), :e) - MAX(start_ts, :s)) / 60) AS minutes
+  FROM breaks
+ WHERE NOT (COALESCE(end_ts, :n) < :s OR start_ts > :e)
+ GROUP BY chat_id, kind
+"""
 
-        for uid in users:
-            # 名称
-            async with db.execute(
-                "SELECT COALESCE(display_name, username, CAST(user_id AS TEXT)) "
-                "FROM checkins WHERE chat_id=? AND user_id=? ORDER BY ts DESC LIMIT 1",
-                (chat_id, uid),
-            ) as cur:
-                r = await cur.fetchone()
-                name = r[0] if r and r[0] else str(uid)
+@metrics.timed_sql("org_rollup")
+async def org_rollup(start_ts: int, end_ts: int, top_n: int = 10, db: Optional[aiosqlite.Connection] = None) -> Dict:
+    """
+    全部群的区间汇总：两条分组查询各扫一遍，再只为 Top N 查名字（代替逐群 summarize_between + 逐人查名字）。
+    返回 {"chats", "headcount", "work_min", "breaks": {kind: [次数, 分钟]},
+          "per_chat": [{"chat_id", "headcount", "work_min", "breaks"}]（按上班分钟降序）,
+          "top": [{"chat_id", "user_id", "name", "work_min"}]}
+    headcount 为去重的 user_id（同一人在多个群只算一次）；per_chat 里按群各算。
+    """
+    params = {"s": start_ts, "e": end_ts, "n": open_end(end_ts)}
+    per_chat: Dict[int, Dict] = {}
+    users = set()
+    top_heap: List[Tuple[int, int, int]] = []
 
-            # 上班分钟（交集）
-            work_min = 0
-            async with db.execute(
-                "SELECT start_ts, COALESCE(end_ts, ?) FROM work_sessions "
-                "WHERE chat_id=? AND user_id=? AND NOT (COALESCE(end_ts, ?) < ? OR start_ts > ?)",
-                (end_ts, chat_id, uid, end_ts, start_ts, end_ts),
-            ) as cur:
-                async for s, e in cur:
-                    s2, e2 = max(s, start_ts), min(e, end_ts)
-                    if e2 > s2:
-                        work_min += (e2 - s2) // 60
+    def chat_row(chat_id: int) -> Dict:
+        r = per_chat.get(chat_id)
+        if r is None:
+            r = per_chat[chat_id] = {"chat_id": chat_id, "headcount": 0, "work_min": 0,
+                                     "breaks": {k: [0, 0] for k in BREAK_KINDS}}
+        return r
 
-            # 次数
-            async with db.execute(
-                "SELECT COUNT(*) FROM breaks WHERE chat_id=? AND user_id=? AND kind='toilet' AND start_ts BETWEEN ? AND ?",
-                (chat_id, uid, start_ts, end_ts),
-            ) as cur:
-                toilet_cnt = (await cur.fetchone())[0] or 0
+    async with _report_conn(db) as db:
+        async with db.execute(_ORG_WORK_SQL, params) as cur:
+            async for chat_id, user_id, work_min in cur:
+                r = chat_row(chat_id)
+                r["headcount"] += 1
+                r["work_min"] += int(work_min)
+                users.add(user_id)
+                item = (int(work_min), -chat_id, -user_id)  # 分钟相同按 chat_id、user_id 升序
+                if len(top_heap) < top_n:
+                    heapq.heappush(top_heap, item)
+                elif top_n > 0 and item > top_heap[0]:
+                    heapq.heapreplace(top_heap, item)
+
+        async with db.execute(_ORG_BREAKS_SQL, params) as cur:
+            async for chat_id, kind, cnt, minutes in cur:
+                if kind in BREAK_KINDS:
+                    chat_row(chat_id)["breaks"][kind] = [int(cnt), int(minutes)]
 
+        top = []
+        for work_min, neg_chat, neg_user in sorted(top_heap, reverse=True):
             async with db.execute(
-                "SELECT COUNT(*) FROM breaks WHERE chat_id=? AND user_id=? AND kind='takeout' AND start_ts BETWEEN ? AND ?",
-                (chat_id, uid, start_ts, end_ts),
+                "SELECT COALESCE(display_name, username) FROM checkins "
+                "WHERE chat_id=? AND user_id=? ORDER BY ts DESC LIMIT 1",
+                (-neg_chat, -neg_user),
             ) as cur:
-                takeout_cnt = (await cur.fetchone())[0] or 0
-
-            rows.append({
-                "user_id": uid,
-                "name": name,
-                "work_min": int(work_min),
-                "toilet_cnt": int(toilet_cnt),
-                "takeout_cnt": int(takeout_cnt),
-            })
-
-    rows.sort(key=lambda x: (-x["work_min"], x["toilet_cnt"], x["takeout_cnt"], x["name"]))
-    return rows
+                r = await cur.fetchone()
+            top.append({"chat_id": -neg_chat, "user_id": -neg_user,
+                        "name": (r[0] if r and r[0] else str(-neg_user)), "work_min": work_min})
+
+    rows = sorted(per_chat.values(), key=lambda r: (-r["work_min"], r["chat_id"]))
+    return {
+        "chats": len(rows),
+        "headcount": len(users),
+        "work_min": sum(r["work_min"] for r in rows),
+        "breaks": {k: [sum(r["breaks"][k][0] for r in rows), sum(r["breaks"][k][1] for r in rows)] for k in BREAK_KINDS},
+        "per_chat": rows,
+        "top": top,
+    }
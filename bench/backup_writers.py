@@ -0,0 +1,71 @@
+# bench/backup_writers.py
+"""
+备份期间的写入延迟：持续按固定速率打卡（storage.add_checkin），先测无备份的窗口，再在同样的写入下跑一次在线备份。
+
+python -m bench.backup_writers --chats 50 --users 100 --days 60
+"""
+import argparse, asyncio, json, os, shutil, tempfile, time
+
+from . import harness, seed as seeder
+
+async def _writer(stop: asyncio.Event, rate: float, lat: list):
+    from app import storage
+    chats = seeder.chat_ids(4)
+    i = 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await storage.add_checkin(chats[i % len(chats)], 900000 + i, "bench", "bench", int(time.time()))
+        lat.append((time.perf_counter() - t0) * 1000)
+        i += 1
+        await asyncio.sleep(max(0.0, 1 / rate - (time.perf_counter() - t0)))
+
+def _summary(lat: list) -> dict:
+    return {"writes": len(lat), "p50_ms": round(harness.percentile(lat, 50), 2),
+            "p99_ms": round(harness.percentile(lat, 99), 2), "max_ms": round(max(lat, default=0), 2)}
+
+async def bench(args, backup_dir: str) -> dict:
+    from app import backup
+
+    results = {}
+    idle: list = []
+    stop = asyncio.Event()
+    w = asyncio.create_task(_writer(stop, args.rate, idle))
+    await asyncio.sleep(args.idle_s)
+    stop.set(); await w
+    results["no_backup"] = _summary(idle)
+
+    busy: list = []
+    stop = asyncio.Event()
+    w = asyncio.create_task(_writer(stop, args.rate, busy))
+    r = await backup.run_backup(backup_dir=backup_dir, pages=args.pages, pause_ms=args.pause_ms)
+    stop.set(); await w
+    results["during_backup"] = _summary(busy)
+    results["backup"] = r
+    ok, notes = await asyncio.to_thread(backup.verify, r["path"])
+    results["verify"] = {"ok": ok, "notes": notes}
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--days", type=int, default=60)
+    ap.add_argument("--rate", type=float, default=50, help="每秒写入次数")
+    ap.add_argument("--idle-s", type=float, default=5, help="无备份对照窗口秒数")
+    ap.add_argument("--pages", type=int, default=256)
+    ap.add_argument("--pause-ms", type=float, default=2)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-backup-")
+    db_path = os.path.join(workdir, "bench.db")
+    try:
+        t0 = time.perf_counter()
+        rows = seeder.seed(db_path, args.chats, args.users, args.days)
+        print(f"seeded {rows} rows in {time.perf_counter() - t0:.1f}s, {os.path.getsize(db_path) / 1e6:.0f}MB")
+        results = asyncio.run(bench(args, os.path.join(workdir, "backups")))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
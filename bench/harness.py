@@ -0,0 +1,86 @@
+# bench/harness.py
+"""压测公共部分：拉起 Bot API 桩、构造 update、在本进程里启动真实的 bot 应用"""
+import itertools, os, resource, socket, subprocess, sys, time
+from typing import List
+
+import httpx
+
+WEBHOOK_SECRET = "bench"
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class StubApi:
+    """bench.stub_api 子进程（与被测 bot 分开，避免桩本身占用被测事件循环）"""
+
+    def __init__(self):
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.proc = None
+
+    def __enter__(self):
+        self.proc = subprocess.Popen([sys.executable, "-m", "bench.stub_api", "--port", str(self.port)])
+        for _ in range(100):
+            try:
+                httpx.get(f"{self.base}/_calls", timeout=0.5)
+                return self
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise RuntimeError("stub api did not start")
+
+    def __exit__(self, *exc):
+        self.proc.terminate(); self.proc.wait()
+
+    def calls(self) -> dict:
+        return httpx.get(f"{self.base}/_calls").json()
+
+    def reset(self):
+        httpx.post(f"{self.base}/_reset")
+
+    def push_updates(self, updates: List[dict]):
+        httpx.post(f"{self.base}/_updates", json=updates, timeout=60).raise_for_status()
+
+def configure_env(db_path: str, stub: StubApi):
+    """必须在导入 app.main 之前调用（配置在导入时读取）"""
+    os.environ.update(
+        DB_PATH=db_path,
+        BOT_TOKEN="123456:bench",
+        BOT_API_BASE_URL=f"{stub.base}/bot",
+        WEBHOOK_SECRET=WEBHOOK_SECRET,
+        BASE_URL="http://127.0.0.1",
+    )
+
+def lift_rate_limits():
+    """
+    放开外发限流（桩不限流）：否则每群 20 条/分钟的令牌桶会让延迟/吞吐只反映限流参数，看不出代码本身的快慢。
+    必须在 build_application() 之前调用（令牌桶按模块常量创建）。
+    """
+    from app import outbound
+    outbound.GLOBAL_RATE, outbound.GLOBAL_BURST = 1e9, 10**9
+    outbound.GROUP_RATE, outbound.GROUP_BURST = 1e9, 10**9
+    outbound.PRIVATE_RATE, outbound.PRIVATE_BURST = 1e9, 10**9
+
+def text_update(chat_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"用户{user_id}"},
+            "text": text,
+        },
+    }
+
+def percentile(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 单位 KB
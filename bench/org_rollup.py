@@ -0,0 +1,55 @@
+# bench/org_rollup.py
+"""
+组织汇总耗时 vs 群数：每个群数各建一个库，比较一次分组查询（storage.org_rollup）
+与旧做法（逐群 summarize_between，各开一个连接 + 逐人查名字）。
+
+python -m bench.org_rollup --chats 10 50 100 200 --users 50 --days 30
+"""
+import argparse, asyncio, json, os, shutil, tempfile, time
+from datetime import datetime
+
+from . import seed as seeder
+
+async def _measure(chats: int, repeat: int) -> dict:
+    from app import storage, settings
+
+    ref = datetime.fromtimestamp(list(seeder.day_starts(7))[-1], settings.DEFAULT_TZ)  # 最近一个有数据的工作日
+    cfg = settings.compile_settings(0, None)
+    out = {}
+    for period, (s, e, _, _) in (("day", cfg.day_bounds_for(ref)), ("week", cfg.week_bounds_for(ref))):
+        grouped, per_chat = [], []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            await storage.org_rollup(s, e, 10)
+            grouped.append((time.perf_counter() - t0) * 1000)
+            t0 = time.perf_counter()
+            for c in seeder.chat_ids(chats):
+                await storage.summarize_between(c, s, e)
+            per_chat.append((time.perf_counter() - t0) * 1000)
+        out[period] = {"grouped_ms": round(min(grouped), 1), "per_chat_ms": round(min(per_chat), 1)}
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, nargs="+", default=[10, 50, 100, 200])
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--repeat", type=int, default=3, help="每项取最快的一次")
+    args = ap.parse_args()
+
+    results = {}
+    for n in args.chats:
+        workdir = tempfile.mkdtemp(prefix="bench-org-")
+        db_path = os.path.join(workdir, "bench.db")
+        try:
+            rows = seeder.seed(db_path, n, args.users, args.days)
+            from app import storage
+            storage.DB_PATH = db_path  # seed() 只在首次导入 storage 时生效，之后的库要手动切
+            results[n] = {"rows": rows, **asyncio.run(_measure(n, args.repeat))}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"chats={n}: {results[n]}")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
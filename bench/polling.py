@@ -0,0 +1,84 @@
+# bench/polling.py
+"""
+轮询 vs webhook 吞吐：两种模式各用一批群（互不共享外发令牌桶），分别走 webhook（并发回放）和 getUpdates 轮询（桩里排队）。
+外发限流已放开（同 bench.run），比的是接收/分派本身。轮询的计时从 update 推入桩开始，到 offset 越过该阶段最后一条为止。
+
+python -m bench.polling --chats 20 --users 50
+"""
+import argparse, asyncio, json, os, shutil, tempfile, time
+
+import httpx
+
+from . import harness, run, seed as seeder
+
+async def bench(args, stub: harness.StubApi) -> dict:
+    from app import main as bot_main, polling
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    harness.lift_rate_limits()
+    app = bot_main.build_application()
+    bot_main.bot_app = app
+    await app.initialize(); await app.start()
+
+    chats = seeder.chat_ids(args.chats * 2)
+    users = {c: seeder.user_ids(i, args.users) for i, c in enumerate(chats)}
+    mode_chats = {"webhook": chats[:args.chats], "polling": chats[args.chats:]}
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=bot_main.app_fastapi)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for name, phases in run.scenarios(mode_chats["webhook"], users.__getitem__).items():
+                n, t0 = 0, time.perf_counter()
+                for updates in phases:
+                    n += len(await run.replay(client, updates, args.concurrency))
+                results.setdefault(name, {})["webhook_updates_per_s"] = n / (time.perf_counter() - t0)
+
+        stop = asyncio.Event()
+        poller = polling.Poller(app, timeout=1, concurrency=args.concurrency)
+        task = asyncio.create_task(poller.run(stop))
+        try:
+            for name, phases in run.scenarios(mode_chats["polling"], users.__getitem__).items():
+                n, t0 = 0, time.perf_counter()
+                for updates in phases:
+                    await asyncio.to_thread(stub.push_updates, updates)
+                    last = updates[-1]["update_id"]
+                    while poller.offset is None or poller.offset <= last:
+                        if task.done(): task.result()
+                        await asyncio.sleep(0.005)
+                    n += len(updates)
+                results[name]["polling_updates_per_s"] = n / (time.perf_counter() - t0)
+        finally:
+            stop.set(); await task
+    finally:
+        await app.stop(); await app.shutdown()
+
+    for r in results.values():
+        r["polling_vs_webhook"] = r["polling_updates_per_s"] / r["webhook_updates_per_s"]
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=20, help="每种模式的群数（种子数据按两倍生成）")
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--days", type=int, default=7)
+    ap.add_argument("--concurrency", type=int, default=50, help="webhook 并发连接数 / 轮询同时处理的 update 数")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-polling-")
+    db_path = os.path.join(workdir, "bench.db")
+    try:
+        with harness.StubApi() as stub:
+            harness.configure_env(db_path, stub)
+            seeder.seed(db_path, args.chats * 2, args.users, args.days)
+            results = asyncio.run(bench(args, stub))
+            print(f"stub calls: {stub.calls()['by_method']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# bench/report_large.py
+"""
+大群日报：1 个群 × 2000 人，分别测分段消息和 CSV 附件两种发送方式的耗时、外发调用数、峰值 RSS。
+
+python -m bench.report_large --users 2000
+"""
+import argparse, asyncio, os, shutil, tempfile, time
+from datetime import datetime
+from types import SimpleNamespace
+
+from . import harness, seed as seeder
+
+async def bench(users: int, stub: harness.StubApi) -> dict:
+    from app import main as bot_main
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    app = bot_main.build_application()
+    await app.initialize()
+    ctx = SimpleNamespace(bot=app.bot)
+    chat_id = seeder.chat_ids(1)[0]
+    last_day = list(seeder.day_starts(7))[-1]
+    ref = datetime.fromtimestamp(last_day, bot_main.settings.DEFAULT_TZ)
+
+    results = {}
+    try:
+        for mode, threshold in (("messages", users + 1), ("csv", 0)):
+            bot_main.REPORT_DOCUMENT_THRESHOLD = threshold
+            stub.reset()
+            t0 = time.perf_counter()
+            await bot_main.send_daily_report(ctx, chat_id, ref)
+            results[mode] = {
+                "seconds": round(time.perf_counter() - t0, 3),
+                "api_calls": stub.calls()["by_method"],
+            }
+    finally:
+        await app.shutdown()
+    results["peak_rss_mb"] = round(harness.peak_rss_mb(), 1)
+    return results
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=2000)
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-report-")
+    db_path = os.path.join(workdir, "bench.db")
+    try:
+        with harness.StubApi() as stub:
+            harness.configure_env(db_path, stub)
+            seeder.seed(db_path, 1, args.users, 7)
+            results = asyncio.run(bench(args.users, stub))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for k, v in results.items():
+        print(f"{k}: {v}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# bench/run.py
+"""
+离线压测：合成历史 + 回放典型 update 流，经由真实的 webhook() 端点处理，外发调用打到本地 Bot API 桩
+（外发限流已放开，测的是处理本身）。
+
+场景：
+  clockin_0900   09:00 集中上班打卡
+  lunch_breaks   午休如厕高峰（开始 → 结束）
+  clockout_2200  22:00 集中下班打卡，随后逐群生成日报
+
+python -m bench.run                    # 与 bench/baselines.json 对比，退步超过阈值时退出码 1；参数与基线不同时退出码 2
+python -m bench.run --save-baseline    # 把本次结果写成新基线
+"""
+import argparse, asyncio, json, os, shutil, sys, tempfile, time
+from types import SimpleNamespace
+
+import httpx
+
+from . import harness, seed as seeder
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+# 越小越好的指标；其余（updates_per_s）越大越好
+_LOWER_IS_BETTER = ("p50_ms", "p99_ms", "report_total_s", "report_p99_ms", "peak_rss_mb")
+
+def scenarios(chats, users_of):
+    """每个场景是若干阶段，阶段内并发回放，阶段间顺序执行"""
+    def phase(text):
+        return [harness.text_update(c, u, text) for c in chats for u in users_of(c)]
+    return {
+        "clockin_0900": [phase("上班打卡")],
+        "lunch_breaks": [phase("上厕所"), phase("拉完了")],
+        "clockout_2200": [phase("下班打卡")],
+    }
+
+async def replay(client: httpx.AsyncClient, updates, concurrency: int):
+    lat = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(u):
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post(f"/webhook/{harness.WEBHOOK_SECRET}", json=u)
+            r.raise_for_status()
+            lat.append((time.perf_counter() - t0) * 1000)
+
+    await asyncio.gather(*[one(u) for u in updates])
+    return lat
+
+async def bench(args) -> dict:
+    from app import main as bot_main  # configure_env 之后再导入
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    harness.lift_rate_limits()
+    app = bot_main.build_application()
+    bot_main.bot_app = app
+    await app.initialize(); await app.start()
+
+    chats = seeder.chat_ids(args.chats)
+    users = {c: seeder.user_ids(i, args.users) for i, c in enumerate(chats)}
+    results = {}
+    transport = httpx.ASGITransport(app=bot_main.app_fastapi)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            for name, phases in scenarios(chats, users.__getitem__).items():
+                lat, t0 = [], time.perf_counter()
+                for updates in phases:
+                    lat += await replay(client, updates, args.concurrency)
+                wall = time.perf_counter() - t0
+                results[name] = {
+                    "updates": len(lat),
+                    "p50_ms": harness.percentile(lat, 50),
+                    "p99_ms": harness.percentile(lat, 99),
+                    "updates_per_s": len(lat) / wall,
+                }
+
+            # 22:00 日报：逐群生成并发送
+            ctx = SimpleNamespace(bot=app.bot)
+            ref = bot_main.datetime.now(bot_main.settings.DEFAULT_TZ)
+            rep, t0 = [], time.perf_counter()
+            for c in chats:
+                t1 = time.perf_counter()
+                await bot_main.send_daily_report(ctx, c, ref)
+                rep.append((time.perf_counter() - t1) * 1000)
+            results["daily_report"] = {
+                "chats": len(chats),
+                "report_total_s": time.perf_counter() - t0,
+                "report_p99_ms": harness.percentile(rep, 99),
+            }
+    finally:
+        await app.stop(); await app.shutdown()
+
+    results["process"] = {"peak_rss_mb": harness.peak_rss_mb()}
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for scen, metrics in results.items():
+        if scen == "params":
+            continue
+        for k, v in metrics.items():
+            base = baseline.get(scen, {}).get(k)
+            if not base or k in ("updates", "chats"):
+                continue
+            ratio = v / base
+            worse = ratio > 1 + tolerance if k in _LOWER_IS_BETTER else ratio < 1 - tolerance
+            flag = "  <-- 退步" if worse else ""
+            print(f"  {scen}.{k}: {v:.2f} (基线 {base:.2f}, {ratio:.2f}x){flag}")
+            if worse: regressions.append(f"{scen}.{k}")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--tolerance", type=float, default=0.25, help="允许的相对退步幅度")
+    ap.add_argument("--save-baseline", action="store_true")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    try:
+        with harness.StubApi() as stub:
+            harness.configure_env(db_path, stub)
+            t0 = time.perf_counter()
+            rows = seeder.seed(db_path, args.chats, args.users, args.days)
+            print(f"seeded {rows} rows in {time.perf_counter() - t0:.1f}s")
+            results = {"params": {k: getattr(args, k) for k in ("chats", "users", "days", "concurrency")},
+                       **asyncio.run(bench(args))}
+            print(f"stub calls: {stub.calls()['by_method']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved -> {BASELINE_FILE}")
+        return
+    if not os.path.exists(BASELINE_FILE):
+        print("no baseline yet (run with --save-baseline)")
+        return
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+    if baseline.get("params") != results["params"]:
+        # 参数不同的结果没有可比性：拒绝比较，用基线的参数重跑或 --save-baseline
+        print(f"error: baseline was recorded with {baseline.get('params')}, this run used {results['params']}")
+        sys.exit(2)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench/seed.py
+"""
+合成历史数据：N 个群 × M 人 × D 天（截至昨天，ET）。
+每人每天：08:50 签到、09:00–22:00 上班、2 次如厕、1 次取外卖；周末跳过。
+
+python -m bench.seed --db /tmp/bench.db --chats 20 --users 50 --days 30
+"""
+import argparse, asyncio, os, sqlite3, time
+from datetime import datetime, timedelta
+
+import pytz
+
+TZ_ET = pytz.timezone("America/New_York")
+
+def chat_ids(n: int):
+    return [-1001000000000 - i for i in range(n)]
+
+def user_ids(chat_index: int, m: int):
+    return [100000 + chat_index * 10000 + u for u in range(m)]
+
+def day_starts(days: int):
+    today = datetime.now(TZ_ET).date()
+    for back in range(days, 0, -1):
+        d = today - timedelta(days=back)
+        if d.weekday() >= 5:
+            continue
+        yield int(TZ_ET.localize(datetime(d.year, d.month, d.day)).timestamp())
+
+def _rows(chats: int, users: int, days: int):
+    for ci, chat_id in enumerate(chat_ids(chats)):
+        uids = user_ids(ci, users)
+        for day0 in day_starts(days):
+            for k, uid in enumerate(uids):
+                j = k % 7  # 错开一点，避免所有人同一秒
+                yield "checkins", (chat_id, uid, f"u{uid}", f"用户{uid}", day0 + 8 * 3600 + 50 * 60 + j)
+                yield "work", (chat_id, uid, day0 + 9 * 3600 + j * 30, day0 + 22 * 3600 + j * 30)
+                yield "breaks", (chat_id, uid, "toilet", day0 + 11 * 3600 + j * 60, day0 + 11 * 3600 + j * 60 + 600)
+                yield "breaks", (chat_id, uid, "toilet", day0 + 16 * 3600 + j * 60, day0 + 16 * 3600 + j * 60 + 420)
+                yield "breaks", (chat_id, uid, "takeout", day0 + 12 * 3600 + j * 60, day0 + 12 * 3600 + j * 60 + 900)
+
+_SQL = {
+    "checkins": "INSERT INTO checkins(chat_id, user_id, username, display_name, ts) VALUES(?,?,?,?,?)",
+    "work":     "INSERT INTO work_sessions(chat_id, user_id, start_ts, end_ts) VALUES(?,?,?,?)",
+    "breaks":   "INSERT INTO breaks(chat_id, user_id, kind, start_ts, end_ts) VALUES(?,?,?,?,?)",
+}
+
+def seed(db_path: str, chats: int, users: int, days: int, batch: int = 20000) -> int:
+    os.environ["DB_PATH"] = db_path
+    from app import storage
+    asyncio.run(storage.init_db(db_path))
+
+    con = sqlite3.connect(db_path)
+    total = 0
+    buf = {k: [] for k in _SQL}
+    try:
+        with con:
+            for table, row in _rows(chats, users, days):
+                buf[table].append(row)
+                if len(buf[table]) >= batch:
+                    con.executemany(_SQL[table], buf[table]); total += len(buf[table]); buf[table].clear()
+            for table, rows in buf.items():
+                con.executemany(_SQL[table], rows); total += len(rows)
+    finally:
+        con.close()
+    return total
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--days", type=int, default=30)
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    n = seed(args.db, args.chats, args.users, args.days)
+    print(f"seeded {n} rows in {time.perf_counter() - t0:.1f}s -> {args.db}")
+
+if __name__ == "__main__":
+    main()
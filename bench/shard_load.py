@@ -0,0 +1,136 @@
+# bench/shard_load.py
+"""
+分片吞吐压测，对比 N=1,2,4... 时的总吞吐：
+
+- e2e（默认）：拉起 N 个真实 worker 进程（python -m app.main），本进程用 ShardRouter 把“上班打卡” update
+  经本地 TCP 转发过去，外发打到 Bot API 桩；以桩收到的回复数判断处理完成
+- storage：N 个进程各自持有 chat_id % N 的分片库，只跑打卡热路径的存储调用
+  （签到 → 上班 → 如厕开始/结束 → 下班 → 当日累计）
+
+用法：python -m bench.shard_load --chats 64 --users 25 --shards 1 2 4 [--mode storage]
+"""
+import argparse, asyncio, json, multiprocessing as mp, os, shutil, subprocess, tempfile, time
+
+from . import harness, seed as seeder
+
+OPS_PER_USER = 6
+
+def _worker(db_path: str, chat_ids, users: int, barrier, out):
+    os.environ["DB_PATH"] = db_path  # 必须在导入 storage 之前设置
+    from app import storage
+
+    async def one_user(chat_id: int, uid: int, ts: int):
+        await storage.add_checkin(chat_id, uid, f"u{uid}", f"用户{uid}", ts)
+        await storage.start_work(chat_id, uid, ts)
+        await storage.start_break(chat_id, uid, "toilet", ts + 3600)
+        await storage.stop_break(chat_id, uid, "toilet", ts + 4200)
+        await storage.stop_work(chat_id, uid, ts + 8 * 3600)
+        await storage.work_minutes_between(chat_id, uid, ts, ts + 86399)
+
+    async def run():
+        await storage.init_db()
+        barrier.wait()
+        t0 = time.perf_counter()
+        base = int(time.time())
+        await asyncio.gather(*[one_user(c, u, base) for c in chat_ids for u in range(1, users + 1)])
+        out.put(time.perf_counter() - t0)
+
+    asyncio.run(run())
+
+def run_once(n: int, chats: int, users: int, workdir: str) -> float:
+    from app.shard import shard_db_path, shard_of
+
+    ctx = mp.get_context("spawn")
+    barrier, out = ctx.Barrier(n), ctx.Queue()
+    base = os.path.join(workdir, f"load-{n}.db")
+    chat_ids = [-1000000000 - i for i in range(chats)]  # 群 id 为负数
+    procs = []
+    for i in range(n):
+        mine = [c for c in chat_ids if shard_of(c, n) == i]
+        p = ctx.Process(target=_worker, args=(shard_db_path(base, i, n), mine, users, barrier, out))
+        p.start(); procs.append(p)
+    elapsed = max(out.get() for _ in procs)
+    for p in procs: p.join()
+    return chats * users * OPS_PER_USER / elapsed
+
+# ===== e2e：front → worker TCP → 处理 → Bot API 桩 =====
+async def _wait_listening(port: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline: raise
+            await asyncio.sleep(0.2)
+
+async def _drive_front(n: int, base_port: int, chats: int, users: int, stub: harness.StubApi) -> float:
+    from app.shard import ShardRouter
+
+    for i in range(n):
+        await _wait_listening(base_port + i)
+    router = ShardRouter(n, base_port)
+    chat_ids = seeder.chat_ids(chats)
+    raws = [json.dumps(harness.text_update(c, u, "上班打卡")).encode()
+            for ci, c in enumerate(chat_ids) for u in seeder.user_ids(ci, users)]
+    await asyncio.to_thread(stub.reset)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(router.forward(r) for r in raws))
+    # 每条“上班打卡”恰好一条回复
+    while (await asyncio.to_thread(stub.calls))["by_method"].get("sendMessage", 0) < len(raws):
+        if time.perf_counter() - t0 > 300: raise TimeoutError("workers did not finish")
+        await asyncio.sleep(0.05)
+    return len(raws) / (time.perf_counter() - t0)
+
+def run_e2e(n: int, chats: int, users: int, workdir: str, stub: harness.StubApi) -> float:
+    from app import shard
+
+    os.environ["DB_PATH"] = os.path.join(workdir, f"e2e-{n}.db")
+    base_port = harness.free_port()
+    log_path = os.path.join(workdir, f"workers-{n}.log")
+    with open(log_path, "ab") as log_file:
+        procs = shard.spawn_workers(n, base_port, stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            return asyncio.run(_drive_front(n, base_port, chats, users, stub))
+        except Exception:
+            log_file.flush()
+            with open(log_path, "rb") as f:
+                print(f.read()[-4000:].decode(errors="replace"))  # worker 日志尾部，方便排查
+            raise
+        finally:
+            for p in procs: p.terminate()
+            for p in procs: p.wait()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=64)
+    ap.add_argument("--users", type=int, default=25)  # 超过每群令牌桶容量（GROUP_BURST=20）：有群在等限流时，其他群不应被挡住
+    ap.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--mode", choices=("e2e", "storage"), default="e2e")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="shard-load-")
+    try:
+        base_rate = None
+        if args.mode == "storage":
+            print(f"chats={args.chats} users/chat={args.users} ops={args.chats * args.users * OPS_PER_USER}")
+            print("N | ops/s | 加速比")
+            for n in args.shards:
+                rate = run_once(n, args.chats, args.users, workdir)
+                base_rate = base_rate or rate
+                print(f"{n} | {rate:,.0f} | {rate / base_rate:.2f}x")
+            return
+        with harness.StubApi() as stub:
+            harness.configure_env(os.path.join(workdir, "e2e.db"), stub)
+            print(f"chats={args.chats} users/chat={args.users} updates={args.chats * args.users}")
+            print("N | updates/s | 加速比")
+            for n in args.shards:
+                rate = run_e2e(n, args.chats, args.users, workdir, stub)
+                base_rate = base_rate or rate
+                print(f"{n} | {rate:,.0f} | {rate / base_rate:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
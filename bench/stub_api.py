@@ -0,0 +1,107 @@
+# bench/stub_api.py
+"""
+本地 Bot API 桩：按 Telegram 的返回格式回应常用方法，并记录所有外发调用。
+
+python -m bench.stub_api --port 8081
+  POST /bot<token>/<method>   -> {"ok": true, "result": ...}
+  GET  /_calls                -> 已记录调用数（按方法）+ 待投递的 update 数
+  POST /_reset                -> 清空记录
+  POST /_updates              -> 追加待投递的 update（JSON 数组），由 getUpdates 按 offset/limit/timeout 长轮询取走
+"""
+import argparse, asyncio, itertools, json, time
+from collections import Counter, deque
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+
+api = FastAPI()
+calls = []  # (t, method, params)
+_msg_ids = itertools.count(1)
+pending = deque()  # 待投递的 update，update_id 递增
+_arrived = asyncio.Event()
+webhook = {"url": ""}
+
+def _params(body: bytes, content_type: str) -> dict:
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {}  # multipart（发文件）只记方法名
+
+def _chat(params: dict) -> dict:
+    return {"id": int(params.get("chat_id", 0)), "type": "supergroup", "title": "bench"}
+
+def _message(params: dict) -> dict:
+    return {"message_id": next(_msg_ids), "date": int(time.time()), "chat": _chat(params),
+            "from": BOT_USER, "text": params.get("text", "")}
+
+def _member(user_id: int, status: str = "member") -> dict:
+    return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": f"用户{user_id}"}}
+
+def _result(method: str, params: dict):
+    m = method.lower()
+    if m == "getme":
+        return BOT_USER
+    if m in ("sendmessage", "editmessagetext", "senddocument"):
+        return _message(params)
+    if m == "getchatadministrators":
+        return [_member(1000, "creator") | {"is_anonymous": False}]
+    if m == "getchatmember":
+        return _member(int(params.get("user_id", 0)))
+    if m == "setwebhook":
+        webhook["url"] = params.get("url", "")
+    elif m == "deletewebhook":
+        webhook["url"] = ""
+    elif m == "getwebhookinfo":
+        return {"url": webhook["url"], "has_custom_certificate": False, "pending_update_count": 0}
+    return True  # setWebhook / setMyCommands / answerCallbackQuery / deleteWebhook ...
+
+async def _get_updates(params: dict) -> list:
+    """与 Telegram 一致：offset 之前的视为已确认并丢弃；没有新 update 时挂起至多 timeout 秒"""
+    offset, limit = int(params.get("offset") or 0), int(params.get("limit") or 100)
+    while pending and pending[0]["update_id"] < offset:
+        pending.popleft()
+    if not pending and float(params.get("timeout") or 0) > 0:
+        _arrived.clear()
+        try:
+            await asyncio.wait_for(_arrived.wait(), timeout=float(params["timeout"]))
+        except asyncio.TimeoutError:
+            pass
+    return list(itertools.islice(pending, limit))
+
+@api.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    params = _params(await request.body(), request.headers.get("content-type", ""))
+    calls.append((time.time(), method, params))
+    if method.lower() == "getupdates":
+        return JSONResponse({"ok": True, "result": await _get_updates(params)})
+    return JSONResponse({"ok": True, "result": _result(method, params)})
+
+@api.get("/_calls")
+async def get_calls():
+    return JSONResponse({"total": len(calls), "by_method": dict(Counter(m for _, m, _ in calls)),
+                         "pending_updates": len(pending)})
+
+@api.post("/_reset")
+async def reset():
+    calls.clear()
+    return JSONResponse({"ok": True})
+
+@api.post("/_updates")
+async def push_updates(request: Request):
+    pending.extend(await request.json())
+    _arrived.set()
+    return JSONResponse({"ok": True, "pending": len(pending)})
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    args = ap.parse_args()
+    uvicorn.run(api, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()